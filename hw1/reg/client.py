@@ -30,7 +30,7 @@ if os.path.isfile(CONFIG_FILE):
         user_config = json.load(f)
     config = {**default_config, **user_config}
 else:
-    logger.warning(f"No config file found at {CONFIG_FILE}. Using defaults.")
+    logger.warning("No config file found at %s. Using defaults.", CONFIG_FILE)
     config = default_config
 
 SERVER_HOST = config["host"]
@@ -72,6 +72,7 @@ class ChatClient:
         try:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect((SERVER_HOST, SERVER_PORT))
+            protocol.configure_socket(self.sock)
             logger.info("Connected to server successfully")
             
             # Start listener thread
@@ -79,7 +80,7 @@ class ChatClient:
             self.listener_thread.start()
             
         except Exception as e:
-            logger.error(f"Could not connect to server: {e}")
+            logger.error("Could not connect to server: %s", e)
             messagebox.showerror('Connection Error', f'Could not connect to server: {e}')
             self.master.destroy()
             return
@@ -329,6 +330,7 @@ class ChatClient:
                 
                 self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 self.sock.connect((SERVER_HOST, SERVER_PORT))
+                protocol.configure_socket(self.sock)
                 logger.info("Reconnected to server successfully")
                 
                 # Restart listener thread
@@ -337,11 +339,11 @@ class ChatClient:
                 self.listener_thread.start()
                 
             except Exception as e:
-                logger.error(f"Could not connect to server: {e}")
+                logger.error("Could not connect to server: %s", e)
                 messagebox.showerror('Connection Error', f'Could not connect to server: {e}')
                 return
             
-        logger.debug(f"Attempting to register user: {username}")
+        logger.debug("Attempting to register user: %s", username)
         message = protocol.create_message(
             MessageType.CREATE_ACCOUNT,
             {
@@ -367,6 +369,7 @@ class ChatClient:
             
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.connect((SERVER_HOST, SERVER_PORT))
+            protocol.configure_socket(self.sock)
             logger.info("Reconnected to server successfully")
             
             # Restart listener thread
@@ -375,11 +378,11 @@ class ChatClient:
             self.listener_thread.start()
             
         except Exception as e:
-            logger.error(f"Could not connect to server: {e}")
+            logger.error("Could not connect to server: %s", e)
             messagebox.showerror('Connection Error', f'Could not connect to server: {e}')
             return
             
-        logger.debug(f"Attempting to login user: {username}")
+        logger.debug("Attempting to login user: %s", username)
         message = protocol.create_message(
             MessageType.LOGIN,
             {
@@ -391,7 +394,7 @@ class ChatClient:
 
     def list_accounts(self, pattern: str = '%'):
         """Request list of accounts matching pattern."""
-        logger.debug(f"Requesting account list with pattern: {pattern}")
+        logger.debug("Requesting account list with pattern: %s", pattern)
         message = protocol.create_message(
             MessageType.LIST_ACCOUNTS,
             {
@@ -411,7 +414,7 @@ class ChatClient:
             messagebox.showwarning('Input Error', 'Recipient and message required.')
             return
             
-        logger.debug(f"Sending message to {recipient}")
+        logger.debug("Sending message to %s", recipient)
         message = protocol.create_message(
             MessageType.SEND_MESSAGE,
             {
@@ -452,7 +455,7 @@ class ChatClient:
         if not confirm:
             return
             
-        logger.debug(f"Deleting messages: {selected_ids}")
+        logger.debug("Deleting messages: %s", selected_ids)
         message = protocol.create_message(
             MessageType.DELETE_MESSAGES,
             {
@@ -503,7 +506,7 @@ class ChatClient:
         if message['status'] == StatusCode.SUCCESS.value:
             self.username = message['data']['username']
             unread_count = message['data'].get('unread_count', 0)
-            logger.debug(f"Login successful. Unread count for {self.username}: {unread_count}")
+            logger.debug("Login successful. Unread count for %s: %s", self.username, unread_count)
             
             # Create the main chat widgets
             self.create_chat_widgets()
@@ -622,7 +625,19 @@ class ChatClient:
             for user in users:
                 if user != self.username:  # Don't show current user
                     self.user_listbox.insert(tk.END, user)
-                    
+
+        elif broadcast_type == 'presence':
+            # Apply a diff of users who came online or went offline
+            shown = list(self.user_listbox.get(0, tk.END))
+            for user in message['data'].get('left', []):
+                if user in shown:
+                    self.user_listbox.delete(shown.index(user))
+                    shown.remove(user)
+            for user in message['data'].get('joined', []):
+                if user != self.username and user not in shown:
+                    self.user_listbox.insert(tk.END, user)
+                    shown.append(user)
+
         elif broadcast_type == 'messages':
             # Update messages
             messages = message['data'].get('messages', [])
@@ -639,7 +654,7 @@ class ChatClient:
     def handle_error_response(self, message: dict):
         """Handle error response."""
         error_msg = message['data'].get('message', 'Unknown error occurred')
-        logger.error(f"Received error: {error_msg}")
+        logger.error("Received error: %s", error_msg)
         
         # Ignore "not logged in" errors during logout
         if self._logging_out and "not logged in" in error_msg.lower():
@@ -656,7 +671,7 @@ class ChatClient:
         """Handle mark as read response."""
         if message['status'] != StatusCode.SUCCESS.value:
             error_msg = message['data'].get('message', 'Unknown error')
-            logger.error(f"Failed to mark messages as read: {error_msg}")
+            logger.error("Failed to mark messages as read: %s", error_msg)
             # Optionally refresh messages to ensure correct state
             self.get_messages()
 
@@ -687,14 +702,14 @@ class ChatClient:
                     continue
                     
                 if isinstance(message, str):  # Error occurred
-                    logger.error(f"Error receiving message: {message}")
+                    logger.error("Error receiving message: %s", message)
                     continue
                     
-                logger.debug(f"Received message: {message}")
+                logger.debug("Received message: %s", message)
                 
                 # If we're logging out, only process logout responses
                 if self._logging_out and message['type'] != MessageType.LOGOUT.value:
-                    logger.debug(f"Ignoring message during logout: {message['type']}")
+                    logger.debug("Ignoring message during logout: %s", message['type'])
                     continue
                 
                 # Route message to appropriate handler
@@ -704,11 +719,11 @@ class ChatClient:
                 if handler:
                     self.master.after(0, handler, message)
                 else:
-                    logger.warning(f"No handler for message type: {msg_type}")
+                    logger.warning("No handler for message type: %s", msg_type)
                     
             except Exception as e:
                 if not self._logging_out:  # Only log error if not intentionally logging out
-                    logger.error(f"Error in message listener: {e}")
+                    logger.error("Error in message listener: %s", e)
                 break
 
     def stop_listener(self):
@@ -753,7 +768,7 @@ class ChatClient:
             self.sock.close()
             logger.info("Socket closed successfully")
         except Exception as e:
-            logger.error(f"Error closing socket: {e}")
+            logger.error("Error closing socket: %s", e)
         
         # Clear UI and state last
         self.username = None
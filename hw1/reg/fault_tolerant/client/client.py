@@ -1,17 +1,43 @@
 """
 Fault-tolerant client implementation for chat system.
 """
+import hashlib
+import itertools
 import logging
+import selectors
 import socket
 import threading
 import time
+import uuid
+from concurrent.futures import Future
 from typing import Dict, List, Optional, Tuple
 
 from ..common.config import ClusterConfig
-from ..common.protocol import MessageType, StatusCode, create_message, send_json, receive_json
+from ..common.protocol import (MessageType, StatusCode, create_message, send_json,
+                               send_many_json, receive_json, message_type_value,
+                               configure_socket)
 
 logger = logging.getLogger(__name__)
 
+# Seconds to wait for a node to answer a request before treating it as lost.
+# Longer than the node's own 10 s APPLY_TIMEOUT, so a slow commit still gets
+# its answer back instead of being retried.
+RESPONSE_TIMEOUT = 15.0
+
+# Requests that change nothing on the node, so sending one twice is harmless
+IDEMPOTENT_REQUESTS = frozenset({
+    MessageType.LOGOUT,
+    MessageType.LIST_ACCOUNTS,
+    MessageType.GET_MESSAGES,
+})
+
+def hash_password(password: str) -> str:
+    """Hash a password before it leaves the client, as the single-server client does.
+    
+    Both the CLI and the GUI go through ChatClient, so they send the same value.
+    """
+    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
 class ChatClient:
     def __init__(self, config_path: str):
         self.config = ClusterConfig(config_path)
@@ -23,27 +49,78 @@ class ChatClient:
         self.username: Optional[str] = None
         self.current_node: Optional[Dict] = None
         
-        # Message handling
-        self.message_handlers: Dict[MessageType, callable] = {}
-        self.message_lock = threading.Lock()
-        
-        # Background thread for receiving messages
+        # Open connections to cluster nodes, keyed by (host, port), so a
+        # redirect to the leader reuses a socket instead of connecting again
+        self._node_sockets: Dict[Tuple[str, int], socket.socket] = {}
+        
+        # Message handling, keyed by MessageType value.
+        # Only the receiver thread reads this, so registering needs no lock.
+        self.message_handlers: Dict[int, callable] = {}
+        
+        # Requests awaiting a RESPONSE, keyed by the req_id nodes echo back,
+        # along with the socket each was sent on
+        self._pending: Dict[int, Tuple[socket.socket, Future]] = {}
+        self._pending_lock = threading.Lock()
+        self._req_ids = itertools.count(1)
+        # Sent with every request; with the req_id it lets the leader
+        # recognize a retry of a write it already applied
+        self.client_id = uuid.uuid4().hex
+        
+        # Background thread that is the only reader of the node sockets
+        self._selector = selectors.DefaultSelector()
         self.receiver_thread: Optional[threading.Thread] = None
         self.running = False
     
     def register_handler(self, msg_type: MessageType, handler: callable) -> None:
         """Register a handler for a specific message type."""
-        with self.message_lock:
-            self.message_handlers[msg_type] = handler
+        self.message_handlers[msg_type.value] = handler
+    
+    def _get_node_socket(self, host: str, port: int) -> socket.socket:
+        """Return the pooled connection to a node, opening it if needed."""
+        key = (host, port)
+        sock = self._node_sockets.get(key)
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.connect(key)
+            configure_socket(sock)
+            self._node_sockets[key] = sock
+            self._selector.register(sock, selectors.EVENT_READ)
+        return sock
+    
+    def _drop_node_socket(self, sock: socket.socket) -> None:
+        """Remove a connection from the pool and fail its pending requests."""
+        for key, pooled in list(self._node_sockets.items()):
+            if pooled is sock:
+                del self._node_sockets[key]
+        try:
+            self._selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+        
+        with self._pending_lock:
+            lost = [req_id for req_id, (pending_sock, _) in self._pending.items()
+                    if pending_sock is sock]
+            pending = [self._pending.pop(req_id)[1] for req_id in lost]
+        for future in pending:
+            if not future.done():
+                future.set_exception(ConnectionError("Connection to node lost"))
+    
+    def _close_node_sockets(self) -> None:
+        """Close every pooled node connection."""
+        for sock in list(self._node_sockets.values()):
+            self._drop_node_socket(sock)
     
     def connect(self) -> bool:
         """Connect to any available node in the cluster."""
         # Try each node until we find one that's available
         for node in self.nodes:
             try:
-                logger.info(f"Attempting to connect to {node['host']}:{node['port']}")
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.connect((node["host"], node["port"]))
+                logger.info("Attempting to connect to %s:%s", node['host'], node['port'])
+                sock = self._get_node_socket(node["host"], node["port"])
                 
                 self.socket = sock
                 self.current_node = node
@@ -55,11 +132,11 @@ class ChatClient:
                 self.receiver_thread.daemon = True
                 self.receiver_thread.start()
                 
-                logger.info(f"Connected to node {node['id']}")
+                logger.info("Connected to node %s", node['id'])
                 return True
                 
             except Exception as e:
-                logger.warning(f"Failed to connect to {node['host']}:{node['port']}: {e}")
+                logger.warning("Failed to connect to %s:%s: %s", node['host'], node['port'], e)
                 continue
         
         logger.error("Failed to connect to any node in the cluster")
@@ -70,12 +147,9 @@ class ChatClient:
         self.running = False
         self.connected = False
         
-        if self.socket:
-            try:
-                self.socket.close()
-            except:
-                pass
-            self.socket = None
+        # The current socket is one of the pooled connections
+        self._close_node_sockets()
+        self.socket = None
         
         if self.receiver_thread and threading.current_thread() != self.receiver_thread:
             self.receiver_thread.join()
@@ -89,35 +163,60 @@ class ChatClient:
         return self.connect()
     
     def _receive_messages(self) -> None:
-        """Background thread for receiving messages."""
+        """Background thread reading every pooled node connection."""
         while self.running and self.socket:
+            # Time out periodically so disconnect() and newly pooled sockets
+            # are noticed even when no node is sending anything
             try:
-                msg = receive_json(self.socket)
-                if not msg:
-                    break
+                events = self._selector.select(timeout=self.retry_interval)
+            except (OSError, ValueError):
+                continue
+            
+            for key, _ in events:
+                sock = key.fileobj
+                try:
+                    msg = receive_json(sock)
+                except Exception as e:
+                    logger.error("Error receiving message: %s", e)
+                    msg = None
                 
-                self._handle_message(msg)
+                if msg:
+                    self._handle_message(sock, msg)
+                    continue
                 
-            except Exception as e:
-                logger.error(f"Error receiving message: {e}")
+                # Losing a standby connection only shrinks the pool
+                current = sock is self.socket
+                self._drop_node_socket(sock)
+                if current:
+                    self.connected = False
+            
+            if not self.connected:
                 break
         
         # Connection lost
-        self.connected = False
-        self._handle_connection_loss()
+        if self.running:
+            self.connected = False
+            self._handle_connection_loss()
     
-    def _handle_message(self, msg: Dict) -> None:
-        """Handle received message."""
+    def _handle_message(self, sock: socket.socket, msg: Dict) -> None:
+        """Complete the matching pending request or dispatch a pushed message."""
         try:
-            msg_type = MessageType[msg["type"]]
+            msg_type = message_type_value(msg)
+            if msg_type == MessageType.RESPONSE.value:
+                with self._pending_lock:
+                    entry = self._pending.pop(msg.get("req_id"), None)
+                if entry is None:
+                    logger.warning("Dropping response to unknown request %s", msg.get('req_id'))
+                elif not entry[1].done():
+                    entry[1].set_result(msg)
+                return
             
-            with self.message_lock:
-                handler = self.message_handlers.get(msg_type)
-                if handler:
-                    handler(msg["data"])
+            handler = self.message_handlers.get(msg_type)
+            if handler:
+                handler(msg["data"])
                     
         except Exception as e:
-            logger.error(f"Error handling message: {e}")
+            logger.error("Error handling message: %s", e)
     
     def _handle_connection_loss(self) -> None:
         """Handle loss of connection to current node."""
@@ -136,9 +235,33 @@ class ChatClient:
         # This would re-send the last successful login/create account command
         pass
     
+    def _submit(self, sock: socket.socket, msg_type: MessageType, data: Dict,
+                req_id: Optional[int] = None) -> Tuple[Dict, Future]:
+        """Build a request and register the future its response will complete.
+        
+        A retry passes the req_id of its first attempt, so the leader can
+        tell it apart from a new request.
+        """
+        if req_id is None:
+            req_id = next(self._req_ids)
+        future = Future()
+        with self._pending_lock:
+            self._pending[req_id] = (sock, future)
+        return create_message(msg_type, data, req_id, self.client_id), future
+    
+    def _cancel(self, msg: Dict) -> None:
+        """Forget a request whose response is no longer awaited."""
+        with self._pending_lock:
+            self._pending.pop(msg["req_id"], None)
+    
     def _send_with_retry(self, msg_type: MessageType, data: Dict,
                         max_retries: int = 3) -> Optional[Dict]:
-        """Send message with retry on failure."""
+        """Send message with retry on failure.
+        
+        Every attempt reuses one req_id, so a write that was applied but
+        whose response was lost is not applied again by the retry.
+        """
+        req_id = next(self._req_ids)
         retries = 0
         while retries < max_retries:
             try:
@@ -148,12 +271,15 @@ class ChatClient:
                         retries += 1
                         continue
                 
-                msg = create_message(msg_type, data)
-                send_json(self.socket, msg)
-                
-                response = receive_json(self.socket)
-                if not response:
-                    raise ConnectionError("No response received")
+                # Register before sending so the receiver can never see the
+                # response first
+                sock = self.socket
+                msg, future = self._submit(sock, msg_type, data, req_id)
+                try:
+                    send_json(sock, msg)
+                    response = future.result(timeout=RESPONSE_TIMEOUT)
+                finally:
+                    self._cancel(msg)
                 
                 # Check if we need to redirect to a different node
                 if response["data"]["status"] == StatusCode.REDIRECT.name:
@@ -164,27 +290,66 @@ class ChatClient:
                 return response
                 
             except Exception as e:
-                logger.error(f"Error sending {msg_type.name}: {e}")
+                logger.error("Error sending %s: %s", msg_type.name, e)
                 self.connected = False
                 retries += 1
         
         return None
     
+    def send_many(self, requests: List[Tuple[MessageType, Dict]]) -> List[Optional[Dict]]:
+        """Send several requests in one write and wait for all the responses.
+        
+        Responses are returned in request order. A request is sent again on
+        its own through _send_with_retry only if it was redirected or never
+        written. A write whose outcome is unknown, because its response timed
+        out or its connection failed, gets None rather than being applied twice.
+        """
+        responses: List[Optional[Dict]] = [None] * len(requests)
+        # Indexes of requests that are safe to send again
+        resend: List[int] = []
+        
+        if not (self.connected or self.reconnect()):
+            resend = list(range(len(requests)))
+        else:
+            sock = self.socket
+            submitted = [self._submit(sock, msg_type, data) for msg_type, data in requests]
+            try:
+                try:
+                    send_many_json(sock, [msg for msg, _ in submitted])
+                except Exception as e:
+                    logger.error("Error sending batch of %s requests: %s", len(requests), e)
+                    self.connected = False
+                    resend = [i for i, (msg_type, _) in enumerate(requests)
+                              if msg_type in IDEMPOTENT_REQUESTS]
+                else:
+                    deadline = time.monotonic() + RESPONSE_TIMEOUT
+                    for i, (msg, future) in enumerate(submitted):
+                        try:
+                            response = future.result(timeout=max(0, deadline - time.monotonic()))
+                        except Exception as e:
+                            logger.error("No response to %s: %s", requests[i][0].name, e)
+                            if requests[i][0] in IDEMPOTENT_REQUESTS:
+                                resend.append(i)
+                            continue
+                        if response["data"]["status"] == StatusCode.REDIRECT.name:
+                            resend.append(i)
+                        else:
+                            responses[i] = response
+            finally:
+                for msg, _ in submitted:
+                    self._cancel(msg)
+        
+        for i in resend:
+            msg_type, data = requests[i]
+            responses[i] = self._send_with_retry(msg_type, data)
+        return responses
+    
     def _handle_redirect(self, data: Dict) -> None:
         """Handle redirect to new leader."""
         try:
-            # Connect to new leader
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((data["leader_host"], data["leader_port"]))
-            
-            # Switch connection
-            old_socket = self.socket
-            self.socket = sock
-            
-            try:
-                old_socket.close()
-            except:
-                pass
+            # Switch to the leader's connection; the old node's connection stays
+            # pooled in case leadership moves back
+            self.socket = self._get_node_socket(data["leader_host"], data["leader_port"])
             
             # Update current node
             for node in self.nodes:
@@ -192,17 +357,17 @@ class ChatClient:
                     self.current_node = node
                     break
             
-            logger.info(f"Redirected to new leader at {data['leader_host']}:{data['leader_port']}")
+            logger.info("Redirected to new leader at %s:%s", data['leader_host'], data['leader_port'])
             
         except Exception as e:
-            logger.error(f"Failed to handle redirect: {e}")
+            logger.error("Failed to handle redirect: %s", e)
             self.connected = False
     
     def create_account(self, username: str, password: str) -> bool:
         """Create a new account."""
         response = self._send_with_retry(MessageType.CREATE_ACCOUNT, {
             "username": username,
-            "password": password
+            "password": hash_password(password)
         })
         
         if response and response["data"]["status"] == StatusCode.SUCCESS.name:
@@ -214,7 +379,7 @@ class ChatClient:
         """Log in to an existing account."""
         response = self._send_with_retry(MessageType.LOGIN, {
             "username": username,
-            "password": password
+            "password": hash_password(password)
         })
         
         if response and response["data"]["status"] == StatusCode.SUCCESS.name:
@@ -5,17 +5,23 @@ import socket
 import threading
 import tkinter as tk
 from tkinter import simpledialog, ttk, messagebox, scrolledtext
-import hashlib
 import logging
 from datetime import datetime
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from .client import ChatClient as FTClient
 from ..common.protocol import MessageType, StatusCode
 
 logger = logging.getLogger(__name__)
 
+# Message refreshes requested within this many ms are coalesced into one fetch
+UPDATE_DEBOUNCE_MS = 30
+# The nodes do not push 'messages' broadcasts yet, so this poll is what keeps
+# the view current; lengthen it once they do
+POLL_MS = 1000
+
 class GUIClient:
     def __init__(self, master):
         self.master = master
@@ -29,6 +35,12 @@ class GUIClient:
         # GUI state
         self.username = None
         self._logging_out = False
+        self._pending_update_id = None
+        self._poll_id = None
+        
+        # Runs cluster RPCs off the Tk thread. One worker keeps requests in
+        # the order they were made and never writes to the socket concurrently.
+        self._io_pool = ThreadPoolExecutor(max_workers=1)
         
         # Create initial connection
         try:
@@ -41,7 +53,7 @@ class GUIClient:
                                          self.handle_broadcast_message)
             
         except Exception as e:
-            logger.error(f"Could not connect to cluster: {e}")
+            logger.error("Could not connect to cluster: %s", e)
             messagebox.showerror('Connection Error', f'Could not connect to cluster: {e}')
             self.master.destroy()
             return
@@ -94,6 +106,10 @@ class GUIClient:
         self.user_listbox = tk.Listbox(user_frame, height=5)
         self.user_listbox.pack(fill='both', expand=True)
         
+        # Users currently in the listbox, in display order
+        self._last_users = set()
+        self._user_order = []
+        
         refresh_users_btn = ttk.Button(user_frame, text="Refresh Users", command=self.list_accounts)
         refresh_users_btn.pack(fill='x', pady=(5, 0))
         
@@ -129,6 +145,11 @@ class GUIClient:
         # Bind click event to mark messages as read
         self.chat_display.bind('<ButtonRelease-1>', self.on_message_click)
         
+        # Rows currently drawn, keyed by message id, and the ids drawn as
+        # unread, so refreshes and clicks only touch rows that changed
+        self._msg_iid_by_id = {}
+        self._unread_ids = set()
+        
         # Add scrollbar
         scrollbar = ttk.Scrollbar(chat_display_frame, orient=tk.VERTICAL, command=self.chat_display.yview)
         self.chat_display.configure(yscrollcommand=scrollbar.set)
@@ -159,14 +180,37 @@ class GUIClient:
         send_btn = ttk.Button(input_frame, text='Send', command=self.send_message)
         send_btn.pack(side=tk.LEFT)
 
-        # Start periodic updates
+        # Initial fetch, then poll; any message broadcasts refresh sooner
         self.update_messages()
+        if self._poll_id is not None:
+            self.master.after_cancel(self._poll_id)
+        self._poll_id = self.master.after(POLL_MS, self._poll_messages)
     
     def clear_window(self):
         """Clear all widgets from the window."""
         for widget in self.master.winfo_children():
             widget.destroy()
     
+    def _rpc(self, fn, *args, on_ok=None, on_err=None):
+        """Run a cluster RPC on the worker thread and report back on the Tk thread.
+        
+        on_ok gets the result. on_err gets the exception, or None when the
+        call reported failure by returning False or None.
+        """
+        def done(future):
+            error = future.exception()
+            result = None if error else future.result()
+            if error is None and result is not None and result is not False:
+                callback, arg = on_ok, result
+            else:
+                if error:
+                    logger.error("%s failed: %s", fn.__name__, error)
+                callback, arg = on_err, error
+            if callback:
+                self.master.after(0, callback, arg)
+        
+        self._io_pool.submit(fn, *args).add_done_callback(done)
+    
     def register(self):
         """Register a new account."""
         username = self.username_entry.get()
@@ -176,12 +220,14 @@ class GUIClient:
             messagebox.showerror('Error', 'Please enter both username and password')
             return
         
-        if self.ft_client.create_account(username, password):
+        def on_ok(_):
             messagebox.showinfo('Success', 'Account created successfully')
             self.username = username
             self.create_chat_widgets()
-        else:
-            messagebox.showerror('Error', 'Failed to create account')
+        
+        self._rpc(self.ft_client.create_account, username, password,
+                  on_ok=on_ok,
+                  on_err=lambda _: messagebox.showerror('Error', 'Failed to create account'))
     
     def login(self):
         """Log in to an existing account."""
@@ -192,12 +238,14 @@ class GUIClient:
             messagebox.showerror('Error', 'Please enter both username and password')
             return
         
-        if self.ft_client.login(username, password):
+        def on_ok(_):
             messagebox.showinfo('Success', 'Logged in successfully')
             self.username = username
             self.create_chat_widgets()
-        else:
-            messagebox.showerror('Error', 'Failed to log in')
+        
+        self._rpc(self.ft_client.login, username, password,
+                  on_ok=on_ok,
+                  on_err=lambda _: messagebox.showerror('Error', 'Failed to log in'))
     
     def logout(self):
         """Log out from current account."""
@@ -205,12 +253,19 @@ class GUIClient:
             return
         
         self._logging_out = True
-        if self.ft_client.logout():
+        
+        def on_ok(_):
+            self._logging_out = False
             self.username = None
+            # Nothing should keep fetching messages for the login screen
+            self._cancel_updates()
             self.create_login_widgets()
-        else:
+        
+        def on_err(_):
+            self._logging_out = False
             messagebox.showerror('Error', 'Failed to log out')
-        self._logging_out = False
+        
+        self._rpc(self.ft_client.logout, on_ok=on_ok, on_err=on_err)
     
     def send_message(self):
         """Send a message."""
@@ -221,48 +276,137 @@ class GUIClient:
             messagebox.showerror('Error', 'Please enter both recipient and message')
             return
         
-        if self.ft_client.send_message(recipient, content):
-            self.message_entry.delete(0, tk.END)
-            self.update_messages()
-        else:
+        # Clear the entry straight away; put the text back if sending fails
+        self.message_entry.delete(0, tk.END)
+        
+        def on_err(_):
+            if self.message_entry.winfo_exists() and not self.message_entry.get():
+                self.message_entry.insert(0, content)
             messagebox.showerror('Error', 'Failed to send message')
+        
+        self._rpc(self.ft_client.send_message, recipient, content,
+                  on_ok=lambda _: self._schedule_update(), on_err=on_err)
     
     def list_accounts(self):
         """Update the user list."""
-        accounts = self.ft_client.list_accounts()
-        if accounts:
-            self.user_listbox.delete(0, tk.END)
-            for account in accounts:
-                self.user_listbox.insert(tk.END, account)
+        def on_ok(accounts):
+            if accounts and self.user_listbox.winfo_exists():
+                self.render_users(accounts)
+        
+        self._rpc(self.ft_client.list_accounts, on_ok=on_ok)
+    
+    def render_users(self, users):
+        """Patch the user list to match users, touching only rows that changed."""
+        new = set(users)
+        if new == self._last_users:
+            return
+        
+        removed = self._last_users - new
+        for index in reversed(range(len(self._user_order))):
+            if self._user_order[index] in removed:
+                self.user_listbox.delete(index)
+                del self._user_order[index]
+        
+        for user in users:
+            if user not in self._last_users:
+                self.user_listbox.insert(tk.END, user)
+                self._user_order.append(user)
+        self._last_users = new
     
     def update_messages(self):
         """Update the message display."""
-        messages = self.ft_client.get_messages()
-        if messages:
-            self.chat_display.delete(*self.chat_display.get_children())
-            for msg in messages:
-                self.chat_display.insert(
+        username = self.username
+        
+        def on_ok(messages):
+            # The chat view may have been closed, or another user logged in,
+            # while the request was out
+            if self.username == username and self.chat_display.winfo_exists():
+                self.render_messages({msg['id']: msg for msg in messages})
+        
+        self._rpc(self.ft_client.get_messages, on_ok=on_ok)
+    
+    def _schedule_update(self):
+        """Request a message refresh, coalescing bursts into a single fetch."""
+        if self.username and self._pending_update_id is None:
+            self._pending_update_id = self.master.after(UPDATE_DEBOUNCE_MS, self._do_update)
+    
+    def _do_update(self):
+        self._pending_update_id = None
+        self.update_messages()
+    
+    def _cancel_updates(self):
+        """Stop the message poll and drop any refresh that hasn't run yet."""
+        for after_id in (self._poll_id, self._pending_update_id):
+            if after_id is not None:
+                self.master.after_cancel(after_id)
+        self._poll_id = self._pending_update_id = None
+    
+    def _poll_messages(self):
+        """Periodic refresh, coalesced with any broadcast-driven update."""
+        self._schedule_update()
+        self._poll_id = self.master.after(POLL_MS, self._poll_messages)
+    
+    def render_messages(self, messages):
+        """Apply the difference between the drawn rows and the given messages.
+        
+        messages maps message id to message, in display order. Rows are only
+        inserted for new ids, retagged when their read flag changed, and
+        deleted when the message is gone.
+        """
+        for msg_id in self._msg_iid_by_id.keys() - messages.keys():
+            self.chat_display.delete(self._msg_iid_by_id.pop(msg_id))
+            self._unread_ids.discard(msg_id)
+        
+        for index, (msg_id, msg) in enumerate(messages.items()):
+            read = bool(msg.get('read', False))
+            iid = self._msg_iid_by_id.get(msg_id)
+            if iid is None:
+                self._msg_iid_by_id[msg_id] = self.chat_display.insert(
                     '',
-                    'end',
+                    index,
+                    iid=str(msg_id),
                     values=(
                         msg.get('timestamp', ''),
                         msg.get('sender', ''),
                         msg.get('content', '')
                     ),
-                    tags=('unread',) if not msg.get('read', False) else ()
+                    tags=('unread',) if not read else ()
                 )
-        
-        # Schedule next update
-        self.master.after(1000, self.update_messages)
+            elif (msg_id in self._unread_ids) == read:
+                self.chat_display.item(iid, tags=('unread',) if not read else ())
+            
+            if read:
+                self._unread_ids.discard(msg_id)
+            else:
+                self._unread_ids.add(msg_id)
+    
+    def _tag_unread(self, items, unread):
+        """Add or remove the unread tag on many rows in one Tk call."""
+        if items:
+            self.chat_display.tk.call(self.chat_display, 'tag',
+                                      'add' if unread else 'remove', 'unread', items)
     
     def on_message_click(self, event):
         """Handle message click to mark as read."""
-        selection = self.chat_display.selection()
-        if selection:
-            message_ids = [int(item) for item in selection]
-            if self.ft_client.mark_as_read(message_ids):
-                for item in selection:
-                    self.chat_display.item(item, tags=())
+        ids = {int(item) for item in self.chat_display.selection()} & self._unread_ids
+        if not ids:
+            return
+        
+        # Show the messages as read straight away; undo if the request fails
+        self._unread_ids -= ids
+        self._tag_unread([self._msg_iid_by_id[msg_id] for msg_id in ids], False)
+        
+        self._rpc(self.ft_client.mark_as_read, list(ids),
+                  on_err=lambda _: self._restore_unread(ids))
+    
+    def _restore_unread(self, ids):
+        """Restore the unread tags after marking messages as read failed."""
+        logger.warning("Failed to mark messages as read")
+        if not self.chat_display.winfo_exists():
+            return
+        ids = {msg_id for msg_id in ids if msg_id in self._msg_iid_by_id}
+        self._unread_ids |= ids
+        self._tag_unread([self._msg_iid_by_id[msg_id] for msg_id in ids], True)
     
     def handle_broadcast_message(self, data):
         """Handle broadcast messages from server."""
@@ -270,14 +414,11 @@ class GUIClient:
         
         if msg_type == 'users':
             # Update user list
-            users = data.get('users', [])
-            self.user_listbox.delete(0, tk.END)
-            for user in users:
-                self.user_listbox.insert(tk.END, user)
+            self.render_users(data.get('users', []))
         
         elif msg_type == 'messages':
-            # Update messages
-            self.update_messages()
+            # Update messages once the burst of broadcasts settles
+            self._schedule_update()
         
         elif msg_type == 'system':
             # Show system message
@@ -3,24 +3,42 @@ Configuration management for fault-tolerant chat system.
 """
 import json
 import os
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_CONFIG_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "config",
+    "cluster.json"
+)
+
+# Parsed config files keyed by absolute path, with the mtime they were read at
+_CONFIG_CACHE: Dict[str, Tuple[int, Dict]] = {}
 
 class ClusterConfig:
     def __init__(self, config_path: str = None):
-        self.config_path = config_path or os.path.join(
-            os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-            "config",
-            "cluster.json"
-        )
+        self.config_path = config_path or DEFAULT_CONFIG_PATH
         self.config = self._load_config()
+        self._nodes_by_id = {node["id"]: node for node in self.config["nodes"]}
     
     def _load_config(self) -> Dict:
-        """Load configuration from file or create default."""
+        """Load configuration from file or create default.
+        
+        Files are parsed once per process and re-read only if they change.
+        """
+        path = os.path.abspath(self.config_path)
         try:
-            with open(self.config_path, "r") as f:
-                return json.load(f)
+            mtime = os.stat(path).st_mtime_ns
         except FileNotFoundError:
             return self._create_default_config()
+        
+        cached = _CONFIG_CACHE.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        
+        with open(path, "r") as f:
+            config = json.load(f)
+        _CONFIG_CACHE[path] = (mtime, config)
+        return config
     
     def get_all_nodes(self) -> List[Dict]:
         """Get list of all nodes in cluster."""
@@ -28,10 +46,14 @@ class ClusterConfig:
     
     def get_node_by_id(self, node_id: int) -> Dict:
         """Get node configuration by ID."""
-        for node in self.config["nodes"]:
-            if node["id"] == node_id:
-                return node
-        raise ValueError(f"No node found with ID {node_id}")
+        try:
+            return self._nodes_by_id[node_id]
+        except KeyError:
+            raise ValueError(f"No node found with ID {node_id}")
+    
+    def get_socket_buffer_bytes(self) -> Optional[int]:
+        """Get the fixed socket buffer size, or None to let the kernel tune it."""
+        return self.config.get("socket_buffer_bytes")
     
     def get_client_retry_interval_ms(self) -> int:
         """Get client retry interval in milliseconds."""
@@ -3,9 +3,23 @@ Protocol definitions for fault-tolerant chat system.
 """
 import enum
 import json
+import os
 import socket
 import struct
-from typing import Dict, Optional
+import weakref
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+# orjson is optional; it encodes and decodes several times faster than json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# msgpack is optional; when installed it carries the node-to-node Raft RPCs
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 class MessageType(enum.Enum):
     """Message types for client-server and node-node communication."""
@@ -21,7 +35,7 @@ class MessageType(enum.Enum):
     MARK_AS_READ = 9
     RESPONSE = 10
     ACK = 11
-    # BROADCAST = 12
+    BROADCAST = 12
     
     # Node-node messages (Raft protocol)
     REQUEST_VOTE = 20
@@ -41,50 +55,209 @@ class StatusCode(enum.Enum):
     ERROR = 2
     REDIRECT = 3
 
-def create_message(msg_type: MessageType, data: Dict) -> Dict:
-    """Create a message dictionary."""
-    return {
-        "type": msg_type.name,
+# Every frame is a 4-byte big-endian payload length followed by the payload
+FRAME_HEADER = struct.Struct('!I')
+
+# Older peers send the type's name under "type" rather than its value under "t"
+_TYPE_VALUES_BY_NAME = {msg_type.name: msg_type.value for msg_type in MessageType}
+
+def create_message(msg_type: MessageType, data: Dict, req_id: Optional[int] = None,
+                   client_id: Optional[str] = None) -> Dict:
+    """Create a message dictionary.
+    
+    The type goes on the wire as its integer value so receivers can dispatch
+    on it directly. Client requests carry a req_id, which nodes echo in
+    their response so several requests can be in flight on one connection.
+    Together with the client_id it also identifies a write, so a retry of
+    one the leader already applied is not applied again.
+    """
+    msg = {
+        "t": msg_type.value,
         "data": data
     }
+    if req_id is not None:
+        msg["req_id"] = req_id
+    if client_id is not None:
+        msg["client_id"] = client_id
+    return msg
+
+def message_type_value(msg: Dict) -> Optional[int]:
+    """Return the integer MessageType value of a received message."""
+    value = msg.get("t")
+    if value is None:
+        value = _TYPE_VALUES_BY_NAME.get(msg.get("type"))
+    return value
+
+def dumps(obj: Any) -> bytes:
+    """Serialize an object to UTF-8 JSON, using orjson when available.
+    
+    Non-string dict keys are stringified as json.dumps does.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj).encode()
+
+def loads(data: Union[bytes, memoryview]) -> Any:
+    """Parse UTF-8 JSON, using orjson when available.
+    
+    orjson parses a memoryview in place; the json fallback needs a copy.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(str(data, 'utf-8'))
+
+def configure_socket(sock: socket.socket, buffer_size: Optional[int] = None) -> None:
+    """Disable Nagle's algorithm; frames are already written whole.
+    
+    buffer_size fixes the kernel send and receive buffers. Leave it unset
+    to keep Linux's buffer autotuning, which a fixed size turns off.
+    """
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        # Not a TCP socket (e.g. a socketpair)
+        pass
+    if buffer_size:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
+        except OSError:
+            pass
+
+# Raft RPC types start at this value; client-facing messages stay JSON
+RAFT_TYPE_MIN = MessageType.REQUEST_VOTE.value
+
+# A JSON payload always starts with '{'; a msgpack map never does
+_JSON_START = ord('{')
+
+def pack(data: Dict) -> bytes:
+    """Encode a dict compactly: msgpack when available, else JSON.
+    
+    decode_payload reads either encoding back.
+    """
+    if msgpack is not None:
+        return msgpack.packb(data, use_bin_type=True)
+    return dumps(data)
+
+def encode_payload(data: Dict) -> bytes:
+    """Encode a message payload: msgpack for Raft RPCs when available, else JSON."""
+    if data.get("t", 0) >= RAFT_TYPE_MIN:
+        return pack(data)
+    return dumps(data)
+
+def decode_payload(view: Union[bytes, memoryview]) -> Any:
+    """Decode a payload written by encode_payload, telling the codecs apart by its first byte."""
+    if view[0] == _JSON_START:
+        return loads(view)
+    if msgpack is None:
+        raise ValueError("Received a msgpack payload but msgpack is not installed")
+    return msgpack.unpackb(view, raw=False, strict_map_key=False)
+
+def encode_frame_parts(data: Dict) -> List[bytes]:
+    """Encode a message as a frame header and payload, without joining them."""
+    payload = encode_payload(data)
+    return [FRAME_HEADER.pack(len(payload)), payload]
+
+def encode_frame(data: Dict) -> bytes:
+    """Encode a message as a length-prefixed frame."""
+    return b"".join(encode_frame_parts(data))
+
+# Most buffers one sendmsg call accepts
+try:
+    _IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 1024
+
+def _send_buffers(sock: socket.socket, buffers: List[bytes]) -> None:
+    """Write all buffers with gathered writes, so they are never copied together."""
+    if not hasattr(sock, "sendmsg"):
+        # No sendmsg on Windows
+        sock.sendall(b"".join(buffers))
+        return
+    
+    views = [memoryview(buf) for buf in buffers]
+    while views:
+        sent = sock.sendmsg(views[:_IOV_MAX])
+        # Drop what was written and resume mid-buffer after a partial write
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if sent:
+            views[0] = views[0][sent:]
 
 def send_json(sock: socket.socket, data: Dict) -> None:
     """Send JSON data over a socket."""
     try:
-        # Convert data to JSON string
-        json_str = json.dumps(data)
-        json_bytes = json_str.encode()
-        
-        # Send length as 4-byte integer
-        length = len(json_bytes)
-        sock.sendall(struct.pack('!I', length))
-        
-        # Send JSON data
-        sock.sendall(json_bytes)
-        
+        _send_buffers(sock, encode_frame_parts(data))
     except Exception as e:
         raise ConnectionError(f"Error sending JSON: {e}")
 
+def send_many_json(sock: socket.socket, messages: Iterable[Dict]) -> None:
+    """Send several JSON messages over a socket in a single write."""
+    try:
+        _send_buffers(sock, [part for msg in messages for part in encode_frame_parts(msg)])
+    except Exception as e:
+        raise ConnectionError(f"Error sending JSON: {e}")
+
+def decode_frames(buffer: bytearray) -> List[Dict]:
+    """Parse and remove every complete frame at the front of buffer.
+    
+    For non-blocking readers that append whatever recv returns; a trailing
+    partial frame is left in place for the next call.
+    """
+    messages = []
+    offset = 0
+    try:
+        with memoryview(buffer) as view:
+            while len(buffer) - offset >= FRAME_HEADER.size:
+                length = FRAME_HEADER.unpack_from(buffer, offset)[0]
+                end = offset + FRAME_HEADER.size + length
+                if len(buffer) < end:
+                    break
+                messages.append(decode_payload(view[offset + FRAME_HEADER.size:end]))
+                offset = end
+    except Exception as e:
+        raise ConnectionError(f"Error receiving JSON: {e}")
+    del buffer[:offset]
+    return messages
+
+# Size of the receive buffer kept for each socket; larger frames get their own
+RECV_BUFFER_SIZE = 64 * 1024
+
+# Receive buffer per socket, dropped along with the socket
+_recv_buffers = weakref.WeakKeyDictionary()
+
+def _recv_exactly(sock: socket.socket, view: memoryview) -> bool:
+    """Fill view from the socket; False if the peer closes first."""
+    received = 0
+    while received < len(view):
+        n = sock.recv_into(view[received:])
+        if not n:
+            return False
+        received += n
+    return True
+
 def receive_json(sock: socket.socket) -> Optional[Dict]:
     """Receive JSON data from a socket."""
     try:
+        buf = _recv_buffers.get(sock)
+        if buf is None:
+            buf = _recv_buffers[sock] = bytearray(RECV_BUFFER_SIZE)
+        view = memoryview(buf)
+        
         # Read length (4 bytes)
-        length_bytes = sock.recv(4)
-        if not length_bytes or len(length_bytes) != 4:
+        if not _recv_exactly(sock, view[:FRAME_HEADER.size]):
             return None
+        length = FRAME_HEADER.unpack_from(buf)[0]
         
-        length = struct.unpack('!I', length_bytes)[0]
-        
-        # Read JSON data
-        data = bytearray()
-        while len(data) < length:
-            chunk = sock.recv(min(4096, length - len(data)))
-            if not chunk:
-                return None
-            data.extend(chunk)
+        # Read JSON data straight into the buffer
+        if length > len(buf):
+            view = memoryview(bytearray(length))
+        if not _recv_exactly(sock, view[:length]):
+            return None
         
         # Parse JSON
-        return json.loads(data.decode())
+        return decode_payload(view[:length])
         
     except Exception as e:
         raise ConnectionError(f"Error receiving JSON: {e}")
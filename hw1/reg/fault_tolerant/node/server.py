@@ -2,23 +2,58 @@
 Node server implementation for fault-tolerant chat system.
 """
 import argparse
+import concurrent.futures
 import logging
+import queue
+import selectors
 import socket
 import threading
 from typing import Dict, List, Optional, Tuple
 
 from ..common.config import ClusterConfig
-from ..common.protocol import MessageType, NodeRole, StatusCode, create_message, send_json, receive_json
+from ..common.protocol import (MessageType, NodeRole, StatusCode, create_message,
+                               encode_frame, decode_frames, message_type_value,
+                               configure_socket)
 from .state_machine import StateMachine
 
 logger = logging.getLogger(__name__)
 
+# Bytes read from a client socket per readiness event
+RECV_SIZE = 64 * 1024
+
+# Threads running requests; the selector loop itself never blocks on the
+# database or on Raft, so batching sees many commands at once
+HANDLER_WORKERS = 32
+
+# A connection stops being read once it has this many requests in flight or
+# this many response bytes its peer hasn't taken yet, so a client that floods
+# requests without reading replies only stalls itself
+MAX_IN_FLIGHT = 64
+MAX_OUTBOUND_BYTES = 4 * 1024 * 1024
+
+class ConnState:
+    """A client connection served by the selector loop."""
+    def __init__(self, sock: socket.socket, addr: Tuple[str, int]):
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.addr = addr
+        # Received bytes not yet forming a complete frame
+        self.buffer = bytearray()
+        # Encoded responses not yet accepted by the socket
+        self.outbound = bytearray()
+        # Requests handed to the worker pool and not yet answered
+        self.in_flight = 0
+        # Events the selector watches for; 0 while unregistered
+        self.events = selectors.EVENT_READ
+        self.closed = False
+
 class NodeServer:
     def __init__(self, node_id: int, config_path: str = None):
         # Load configuration
         self.config = ClusterConfig(config_path)
         self.node_id = node_id
         self.node_config = self.config.get_node_by_id(node_id)
+        self.socket_buffer_bytes = self.config.get_socket_buffer_bytes()
         
         # Initialize state machine
         self.state_machine = StateMachine(node_id, self.config.get_all_nodes(), f"node{node_id}.db")
@@ -27,130 +62,270 @@ class NodeServer:
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.socket.bind((self.node_config["host"], self.node_config["port"]))
-        self.socket.listen(5)
+        # Use the kernel's largest accept queue so a reconnect storm after a
+        # leader change isn't refused; the selector loop drains it in bursts
+        self.socket.listen(socket.SOMAXCONN)
+        self.socket.setblocking(False)
+        
+        # Client connections, keyed by file descriptor, all served by one
+        # selector loop instead of a thread each. Sockets are non-blocking;
+        # requests run on the worker pool and their responses come back
+        # through _completed, with a byte on the wakeup pair to rouse select.
+        self.selector = selectors.DefaultSelector()
+        self.clients: Dict[int, ConnState] = {}
+        self._workers = concurrent.futures.ThreadPoolExecutor(
+            max_workers=HANDLER_WORKERS, thread_name_prefix=f"node-{node_id}")
+        self._completed: "queue.SimpleQueue[Tuple[ConnState, bytes]]" = queue.SimpleQueue()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
         
-        # Client connections
-        self.clients: Dict[socket.socket, threading.Thread] = {}
-        self.clients_lock = threading.Lock()
+        # Raft RPC handlers keyed by MessageType value; anything else is a
+        # client request for the state machine
+        self._dispatch = {
+            MessageType.REQUEST_VOTE.value: self._handle_vote_request,
+            MessageType.REQUEST_VOTE_RESPONSE.value: self._handle_vote_response,
+        }
         
         # Node state
         self.running = True
+        self._stopped = False
     
     def start(self) -> None:
         """Start the node server."""
-        logger.info(f"Starting node {self.node_id}")
+        logger.info("Starting node %s", self.node_id)
         
         # Start election timer thread
         election_thread = threading.Thread(target=self._run_election_timer)
         election_thread.daemon = True
         election_thread.start()
         
-        # Accept client connections
+        # Accept and serve client connections
+        self.selector.register(self.socket, selectors.EVENT_READ, self._accept)
+        self.selector.register(self._wakeup_recv, selectors.EVENT_READ, self._drain_completed)
         try:
             while self.running:
-                client_sock, addr = self.socket.accept()
-                logger.info(f"New connection from {addr}")
-                
-                client_thread = threading.Thread(target=self._handle_client, args=(client_sock,))
-                client_thread.daemon = True
-                client_thread.start()
-                
-                with self.clients_lock:
-                    self.clients[client_sock] = client_thread
+                # Wake up periodically so stop() is noticed
+                for key, mask in self.selector.select(timeout=1.0):
+                    key.data(key.fileobj, mask)
                 
         except Exception as e:
-            logger.error(f"Error in server loop: {e}")
+            logger.error("Error in server loop: %s", e)
         finally:
             self.stop()
     
     def stop(self) -> None:
         """Stop the node server."""
-        logger.info(f"Stopping node {self.node_id}")
+        if self._stopped:
+            return
+        self._stopped = True
+        logger.info("Stopping node %s", self.node_id)
         self.running = False
         
         # Close all client connections
-        with self.clients_lock:
-            for sock in self.clients:
-                try:
-                    sock.close()
-                except:
-                    pass
-            self.clients.clear()
+        for fd in list(self.clients):
+            self._close_client(fd)
         
         # Close server socket
         try:
             self.socket.close()
         except:
             pass
+        self._workers.shutdown(wait=False, cancel_futures=True)
+        self.selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+        self.state_machine.close()
     
     def _run_election_timer(self) -> None:
         """Run election timer thread."""
         while self.running:
-            if self.state_machine.check_election_timeout():
+            if self.state_machine.wait_for_heartbeat():
                 self.state_machine.start_election()
     
-    def _handle_client(self, client_sock: socket.socket) -> None:
-        """Handle client connection."""
+    def _accept(self, server_sock: socket.socket, mask: int) -> None:
+        """Accept every pending client connection and add them to the selector."""
+        while True:
+            try:
+                client_sock, addr = server_sock.accept()
+            except BlockingIOError:
+                return
+            client_sock.setblocking(False)
+            configure_socket(client_sock, self.socket_buffer_bytes)
+            logger.info("New connection from %s", addr)
+            
+            conn = ConnState(client_sock, addr)
+            self.clients[client_sock.fileno()] = conn
+            self.selector.register(client_sock, conn.events, self._handle_client)
+    
+    def _close_client(self, fd: int) -> None:
+        """Remove a client connection from the selector and close it."""
+        conn = self.clients.pop(fd, None)
+        if conn is None:
+            return
+        conn.closed = True
         try:
-            while self.running:
-                msg = receive_json(client_sock)
-                if not msg:
-                    break
-                
-                response = self._handle_message(msg)
-                send_json(client_sock, response)
+            self.selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            conn.sock.close()
+        except:
+            pass
+    
+    def _update_events(self, conn: ConnState) -> None:
+        """Watch a connection for what it can use: reads while under its limits, writes while output is pending."""
+        events = 0
+        if conn.in_flight < MAX_IN_FLIGHT and len(conn.outbound) < MAX_OUTBOUND_BYTES:
+            events |= selectors.EVENT_READ
+        if conn.outbound:
+            events |= selectors.EVENT_WRITE
+        if events == conn.events:
+            return
+        if not events:
+            self.selector.unregister(conn.sock)
+        elif not conn.events:
+            self.selector.register(conn.sock, events, self._handle_client)
+        else:
+            self.selector.modify(conn.sock, events, self._handle_client)
+        conn.events = events
+    
+    def _handle_client(self, client_sock: socket.socket, mask: int) -> None:
+        """Handle a readable or writable client connection.
+        
+        Complete requests are handed to the worker pool; nothing here waits
+        on the state machine or on the peer reading its responses.
+        """
+        fd = client_sock.fileno()
+        conn = self.clients[fd]
+        try:
+            if mask & selectors.EVENT_WRITE:
+                self._flush(conn)
+            if mask & selectors.EVENT_READ:
+                try:
+                    data = client_sock.recv(RECV_SIZE)
+                except BlockingIOError:
+                    data = None
+                if data == b"":
+                    self._close_client(fd)
+                    return
+                if data:
+                    conn.buffer += data
+                    for msg in decode_frames(conn.buffer):
+                        conn.in_flight += 1
+                        self._workers.submit(self._run_request, conn, msg)
+            self._update_events(conn)
                 
         except Exception as e:
-            logger.error(f"Error handling client: {e}")
-        finally:
-            with self.clients_lock:
-                self.clients.pop(client_sock, None)
-            try:
-                client_sock.close()
-            except:
+            logger.error("Error handling client: %s", e)
+            self._close_client(fd)
+    
+    def _flush(self, conn: ConnState) -> None:
+        """Write as much pending output as the socket takes without blocking."""
+        try:
+            sent = conn.sock.send(conn.outbound)
+        except BlockingIOError:
+            return
+        del conn.outbound[:sent]
+    
+    def _run_request(self, conn: ConnState, msg: Dict) -> None:
+        """Worker: handle one request and queue its response for the selector loop.
+        
+        A completion is always queued, even if handling or encoding fails,
+        so the connection's in-flight count is released and the client gets
+        an answer.
+        """
+        try:
+            response = self._handle_message(msg)
+            # Echo the request ID so pipelining clients can match responses
+            if "req_id" in msg:
+                response["req_id"] = msg["req_id"]
+            frame = encode_frame(response)
+        except Exception as e:
+            logger.error("Error building response: %s", e)
+            response = create_message(MessageType.RESPONSE, {
+                "status": StatusCode.ERROR.name,
+                "message": "Internal error"
+            }, msg.get("req_id") if isinstance(msg, dict) else None)
+            frame = encode_frame(response)
+        self._completed.put((conn, frame))
+        try:
+            self._wakeup_send.send(b"\0")
+        except (BlockingIOError, OSError):
+            # Already awake, or shutting down
+            pass
+    
+    def _drain_completed(self, wakeup_sock: socket.socket, mask: int) -> None:
+        """Move finished responses onto their connections and start sending them."""
+        try:
+            while wakeup_sock.recv(4096):
                 pass
+        except BlockingIOError:
+            pass
+        
+        touched = {}
+        while True:
+            try:
+                conn, frame = self._completed.get_nowait()
+            except queue.Empty:
+                break
+            conn.in_flight -= 1
+            if not conn.closed:
+                conn.outbound += frame
+                touched[id(conn)] = conn
+        
+        # Responses that completed together leave in one write
+        for conn in touched.values():
+            try:
+                self._flush(conn)
+                self._update_events(conn)
+            except Exception as e:
+                logger.error("Error sending to client: %s", e)
+                self._close_client(conn.fd)
     
     def _handle_message(self, msg: Dict) -> Dict:
         """Handle client message."""
         try:
-            msg_type = MessageType[msg["type"]]
-            
-            # Handle Raft protocol messages
-            if msg_type == MessageType.REQUEST_VOTE:
-                term, granted = self.state_machine.handle_vote_request(
-                    msg["data"]["term"],
-                    msg["data"]["candidate_id"],
-                    msg["data"]["last_log_index"],
-                    msg["data"]["last_log_term"]
-                )
-                return create_message(MessageType.REQUEST_VOTE_RESPONSE, {
-                    "term": term,
-                    "vote_granted": granted
-                })
-            
-            elif msg_type == MessageType.REQUEST_VOTE_RESPONSE:
-                self.state_machine.handle_vote_response(
-                    msg["data"]["term"],
-                    msg["data"]["voter_id"],
-                    msg["data"]["vote_granted"]
-                )
-                return create_message(MessageType.ACK, {})
-            
-            # Handle client requests
-            else:
-                status, data = self.state_machine.apply_command(msg)
-                return create_message(MessageType.RESPONSE, {
-                    "status": status.name,
-                    **(data or {})
-                })
+            handler = self._dispatch.get(message_type_value(msg), self._handle_client_request)
+            return handler(msg)
                 
         except Exception as e:
-            logger.error(f"Error handling message: {e}")
+            logger.error("Error handling message: %s", e)
             return create_message(MessageType.RESPONSE, {
                 "status": StatusCode.ERROR.name,
                 "message": str(e)
             })
 
+    def _handle_vote_request(self, msg: Dict) -> Dict:
+        """Handle a RequestVote RPC from a candidate."""
+        term, granted = self.state_machine.handle_vote_request(
+            msg["data"]["term"],
+            msg["data"]["candidate_id"],
+            msg["data"]["last_log_index"],
+            msg["data"]["last_log_term"]
+        )
+        return create_message(MessageType.REQUEST_VOTE_RESPONSE, {
+            "term": term,
+            "vote_granted": granted
+        })
+    
+    def _handle_vote_response(self, msg: Dict) -> Dict:
+        """Handle a vote from another node."""
+        self.state_machine.handle_vote_response(
+            msg["data"]["term"],
+            msg["data"]["voter_id"],
+            msg["data"]["vote_granted"]
+        )
+        return create_message(MessageType.ACK, {})
+    
+    def _handle_client_request(self, msg: Dict) -> Dict:
+        """Apply a client request to the state machine."""
+        status, data = self.state_machine.apply_command(msg)
+        return create_message(MessageType.RESPONSE, {
+            "status": status.name,
+            **(data or {})
+        })
+
 def main():
     # Configure logging
     logging.basicConfig(
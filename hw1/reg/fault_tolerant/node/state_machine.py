@@ -2,59 +2,308 @@
 State machine implementation for fault-tolerant chat system.
 Implements Raft consensus algorithm for leader election and log replication.
 """
+import concurrent.futures
 import logging
+import mmap
+import os
+import queue
 import sqlite3
+import struct
 import threading
 import time
-from typing import Dict, List, Optional, Tuple
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
 import random
-import json
 
-from ..common.protocol import MessageType, NodeRole, StatusCode
+from ..common.protocol import (MessageType, NodeRole, StatusCode, message_type_value,
+                               pack, decode_payload, loads)
 
 logger = logging.getLogger(__name__)
 
+# Applied to every connection. WAL itself is persistent and set once in _init_db.
+DB_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Statements run by the command handlers, kept identical across calls so the
+# connection's statement cache always hits
+_SQL_CREATE_ACCOUNT = "INSERT INTO accounts (username, password) VALUES (?, ?)"
+_SQL_LOGIN_SELECT = "SELECT password FROM accounts WHERE username = ?"
+_SQL_LOGIN_UPDATE = "UPDATE accounts SET last_login = CURRENT_TIMESTAMP WHERE username = ?"
+_SQL_DELETE_ACCOUNT = "DELETE FROM accounts WHERE username = ?"
+_SQL_LIST_ACCOUNTS = "SELECT username FROM accounts"
+_SQL_INSERT_MSG = "INSERT INTO messages (sender, recipient, content) VALUES (?, ?, ?)"
+_SQL_GET_MSGS = """
+    SELECT id, sender, recipient, content, timestamp, read
+    FROM messages
+    WHERE recipient = ?
+    ORDER BY timestamp DESC
+"""
+# Bulk operations run these once per id with executemany, so any number of
+# ids shares one prepared statement
+_SQL_DELETE_MSG = "DELETE FROM messages WHERE id = ?"
+_SQL_MARK_READ = "UPDATE messages SET read = 1 WHERE id = ?"
+
+# Statements cached per connection, up from sqlite3's default of 128
+STATEMENT_CACHE_SIZE = 256
+
+# Results of client writes, so a request retried with the same client_id and
+# req_id gets its first answer back instead of being applied again
+_SQL_APPLIED_SELECT = "SELECT status, result FROM applied_requests WHERE client_id = ? AND req_id = ?"
+_SQL_APPLIED_INSERT = """
+    INSERT INTO applied_requests (client_id, req_id, status, result, applied_at)
+    VALUES (?, ?, ?, ?, ?)
+"""
+_SQL_APPLIED_PRUNE = "DELETE FROM applied_requests WHERE applied_at < ?"
+
+# Term and vote live in row 1 of raft_state; one UPDATE dirties one page
+_SQL_SAVE_RAFT_STATE = "UPDATE raft_state SET current_term = ?, voted_for = ? WHERE rowid = 1"
+
+# Raft log records in the append-only WAL file: term, index and command
+# length, then the command packed with msgpack (or JSON without it), then a CRC32 of everything before it
+_WAL_HEADER = struct.Struct("<QQI")
+_WAL_CRC = struct.Struct("<I")
+
+# PRAGMA user_version of a database whose Raft log has moved out of the
+# raft_log table into the WAL file
+SCHEMA_VERSION = 1
+
+# fdatasync skips the metadata flush fsync does, but isn't on every platform
+_fdatasync = getattr(os, "fdatasync", os.fsync)
+
+# Most client commands the leader commits and replicates together
+MAX_BATCH_SIZE = 100
+
+# Commands answered from the local database without going through the log
+READ_ONLY_COMMANDS = frozenset({
+    MessageType.LOGOUT,
+    MessageType.LIST_ACCOUNTS,
+    MessageType.GET_MESSAGES,
+})
+
+# Client commands and the data fields each one needs; anything else is
+# rejected before it can reach the log
+COMMAND_FIELDS: Dict[MessageType, Tuple[str, ...]] = {
+    MessageType.CREATE_ACCOUNT: ("username", "password"),
+    MessageType.LOGIN: ("username", "password"),
+    MessageType.LOGOUT: (),
+    MessageType.DELETE_ACCOUNT: ("username",),
+    MessageType.LIST_ACCOUNTS: (),
+    MessageType.SEND_MESSAGE: ("sender", "recipient", "content"),
+    MessageType.GET_MESSAGES: ("username",),
+    MessageType.DELETE_MESSAGES: ("message_ids",),
+    MessageType.MARK_AS_READ: ("message_ids",),
+}
+
+# Longest a client request waits for its batch to commit
+APPLY_TIMEOUT = 10.0
+
+# Seconds a write's result is kept for answering retries of it, well past
+# the longest a client keeps retrying one request
+APPLIED_REQUEST_RETENTION = 600
+# Seconds between sweeps of expired results
+APPLIED_REQUEST_PRUNE_INTERVAL = 60
+
+# How long the persister waits for more term/vote changes to share a commit
+PERSIST_SYNC_INTERVAL = 0.001
+
 class LogEntry:
     def __init__(self, term: int, command: Dict, index: int):
         self.term = term
         self.command = command
         self.index = index
 
+class PendingCommand:
+    """A client command waiting for the leader to commit its batch."""
+    def __init__(self, command: Dict):
+        self.command = command
+        self.done = threading.Event()
+        self.result: Tuple[StatusCode, Optional[Dict]] = (StatusCode.ERROR, None)
+
 class StateMachine:
     def __init__(self, node_id: int, nodes: List[Dict], db_path: str):
         self.node_id = node_id
         self.nodes = nodes
         self.db_path = db_path
+        self._nodes_by_id = {node["id"]: node for node in nodes}
+        self._peers = [node for node in nodes if node["id"] != node_id]
+        # Votes are tracked as a bitmask with one bit per node
+        self._vote_bits = {node["id"]: 1 << i for i, node in enumerate(nodes)}
         
         # Persistent state
         self.current_term = 0
         self.voted_for = None
         self.log: List[LogEntry] = []
+        # Index and term of the last log entry, kept by _append_log and
+        # _truncate_log; -1 and 0 while the log is empty
+        self._last_log_index = -1
+        self._last_log_term = 0
         
         # Volatile state
         self.commit_index = 0
         self.last_applied = 0
         self.role = NodeRole.FOLLOWER
         self.leader_id = None
-        self.votes_received = set()
+        self.votes_received = 0
         
-        # Leader volatile state
-        self.next_index: Dict[int, int] = {}
-        self.match_index: Dict[int, int] = {}
+        # Leader volatile state, reset in place on each leadership change
+        self.next_index: Dict[int, int] = dict.fromkeys(self._nodes_by_id, 0)
+        self.match_index: Dict[int, int] = dict.fromkeys(self._nodes_by_id, 0)
         
-        # Initialize database
+        # Initialize database. Commands reuse one connection per thread,
+        # tracked so close() can release them on shutdown.
         self._init_db()
+        self._tls = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+        
+        # The Raft log lives in its own append-only file, so appending to it
+        # never waits behind chat table writes in the database's WAL.
+        # _wal_offsets holds the file offset of each entry's record, so the
+        # file can be cut back along with the log; _wal_end is where the
+        # last complete record ends.
+        self._wal = open(f"{db_path}.raftwal", "ab+", buffering=0)
+        self._wal_offsets: List[int] = []
+        self._wal_end = 0
+        self._migrate_log_table()
+        self._append_log(self._load_wal())
         
-        # Election timer
-        self.last_heartbeat = time.time()
+        # Election timer; the event wakes the timer thread whenever it is reset.
+        # Monotonic, so wall-clock adjustments can't trigger or delay elections.
+        self.last_heartbeat = time.monotonic()
         self.election_timeout = self._get_random_timeout()
+        self._heartbeat_event = threading.Event()
+        
+        # Locks for thread safety: one for term, vote and role, one for the
+        # log and commit index. When both are needed, take _term_lock first.
+        self._term_lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        
+        # Term and vote changes are queued for a writer thread that commits
+        # only the latest value from each burst
+        self._persist_queue: "queue.Queue[Tuple[int, Optional[int], concurrent.futures.Future]]" = queue.Queue()
+        self._persist_thread = threading.Thread(target=self._run_persister, daemon=True)
+        self._persist_thread.start()
+        
+        # Write commands are queued for an applier thread that appends,
+        # commits and replicates them in batches of up to MAX_BATCH_SIZE
+        self._pending: List[PendingCommand] = []
+        self._pending_cv = threading.Condition()
+        self._closed = False
+        self._next_applied_prune = time.monotonic()
+        # Sends RPCs to every peer at once; also lets each batch's
+        # AppendEntries go out while the leader commits it locally
+        self._replication_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, len(self._peers)), thread_name_prefix=f"replicate-{node_id}")
+        self._applier_thread = threading.Thread(target=self._run_applier, daemon=True)
+        self._applier_thread.start()
+    
+    def _open_conn(self) -> sqlite3.Connection:
+        """Open a tuned connection to this node's database.
         
-        # Lock for thread safety
-        self.lock = threading.Lock()
+        Autocommit mode: each statement commits on its own unless a caller
+        opens a transaction explicitly with BEGIN IMMEDIATE. Each connection
+        is used by one thread, but close() may run on another.
+        """
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in DB_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    def _get_conn(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._tls, "conn", None)
+        if conn is None:
+            conn = self._tls.conn = self._open_conn()
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+    
+    def close(self) -> None:
+        """Stop the applier and close every connection handed out by _get_conn."""
+        with self._pending_cv:
+            self._closed = True
+            self._pending_cv.notify_all()
+        with self._conns_lock:
+            for conn in self._conns:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._conns.clear()
+        self._replication_pool.shutdown(wait=False)
+        self._wal.close()
+    
+    def _load_wal(self) -> List[LogEntry]:
+        """Rebuild the log from the WAL file, cutting off a torn final record."""
+        size = os.fstat(self._wal.fileno()).st_size
+        if not size:
+            return []
+        
+        log = []
+        offset = 0
+        with mmap.mmap(self._wal.fileno(), size, access=mmap.ACCESS_READ) as data:
+            while offset + _WAL_HEADER.size <= size:
+                term, index, length = _WAL_HEADER.unpack_from(data, offset)
+                end = offset + _WAL_HEADER.size + length
+                if end + _WAL_CRC.size > size or \
+                   _WAL_CRC.unpack_from(data, end)[0] != zlib.crc32(data[offset:end]):
+                    break
+                command = decode_payload(data[offset + _WAL_HEADER.size:end])
+                log.append(LogEntry(term, command, index))
+                self._wal_offsets.append(offset)
+                offset = end + _WAL_CRC.size
+        
+        if offset < size:
+            logger.warning("Discarding %s bytes of incomplete Raft log", size - offset)
+            self._wal.truncate(offset)
+        self._wal_end = offset
+        return log
+    
+    @staticmethod
+    def _encode_wal_record(entry: LogEntry) -> bytes:
+        """Encode one log entry as a WAL record."""
+        command = pack(entry.command)
+        record = _WAL_HEADER.pack(entry.term, entry.index, len(command)) + command
+        return record + _WAL_CRC.pack(zlib.crc32(record))
+    
+    def _write_wal(self, data: bytes) -> None:
+        """Append bytes to the WAL file and sync them.
+        
+        The file is unbuffered, so each write is one system call that may
+        take fewer bytes than it was given.
+        """
+        view = memoryview(data)
+        while view:
+            view = view[self._wal.write(view):]
+        _fdatasync(self._wal.fileno())
+    
+    def _append_to_wal(self, entries: List[LogEntry]) -> None:
+        """Durably append log entries to the WAL file with one write and sync."""
+        records = []
+        offsets = []
+        offset = self._wal_end
+        for entry in entries:
+            records.append(self._encode_wal_record(entry))
+            offsets.append(offset)
+            offset += len(records[-1])
+        self._write_wal(b"".join(records))
+        
+        with self._log_lock:
+            self._wal_offsets.extend(offsets)
+            self._wal_end = offset
     
     def _init_db(self) -> None:
         """Initialize SQLite database."""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._open_conn()
+        # WAL lets readers proceed during a commit and makes each commit one
+        # append to the log instead of a journal rewrite
+        conn.execute("PRAGMA journal_mode=WAL")
         c = conn.cursor()
         
         # Create tables
@@ -76,92 +325,295 @@ class StateMachine:
             FOREIGN KEY (recipient) REFERENCES accounts(username)
         )''')
         
+        c.execute('''CREATE TABLE IF NOT EXISTS applied_requests (
+            client_id TEXT NOT NULL,
+            req_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            result BLOB,
+            applied_at REAL NOT NULL,
+            PRIMARY KEY (client_id, req_id)
+        ) WITHOUT ROWID''')
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_applied_requests_applied_at
+            ON applied_requests (applied_at)''')
+        
+        # Lets _handle_get_messages read a recipient's messages in order
+        # straight off the index instead of scanning and sorting the table
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_messages_recipient_ts
+            ON messages (recipient, timestamp DESC)''')
+        
         # Create tables for Raft state
         c.execute('''CREATE TABLE IF NOT EXISTS raft_state (
             current_term INTEGER,
             voted_for TEXT
         )''')
-        
-        c.execute('''CREATE TABLE IF NOT EXISTS raft_log (
-            index_id INTEGER PRIMARY KEY,
-            term INTEGER,
-            command TEXT
-        )''')
+        # A single row, rewritten in place on every term or vote change
+        c.execute("INSERT OR IGNORE INTO raft_state (rowid, current_term, voted_for) VALUES (1, 0, NULL)")
         
         conn.commit()
         conn.close()
     
+    def _migrate_log_table(self) -> None:
+        """Move a log left in the old raft_log table into the WAL file, once.
+        
+        The table is only dropped after its entries are durable in the file,
+        and only if the file was still empty; user_version records that the
+        move is done.
+        """
+        conn = self._open_conn()
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+                return
+            has_table = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'raft_log'").fetchone()
+            if has_table:
+                rows = conn.execute(
+                    "SELECT term, index_id, command FROM raft_log ORDER BY index_id").fetchall()
+                if rows and os.fstat(self._wal.fileno()).st_size:
+                    logger.error("Both raft_log and %s.raftwal hold a Raft log; "
+                                 "leaving raft_log in place", self.db_path)
+                    return
+                if rows:
+                    self._write_wal(b"".join(
+                        self._encode_wal_record(LogEntry(term, loads(command), index))
+                        for term, index, command in rows))
+                    logger.info("Moved %s Raft log entries out of raft_log", len(rows))
+                conn.execute("DROP TABLE raft_log")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        finally:
+            conn.close()
+    
     def apply_command(self, command: Dict) -> Tuple[StatusCode, Optional[Dict]]:
-        """Apply a command to the state machine."""
-        with self.lock:
+        """Apply a command to the state machine.
+        
+        Reads are served straight from the database. Writes are handed to
+        the applier thread and this blocks until their batch has committed.
+        """
+        with self._term_lock:
             if self.role != NodeRole.LEADER:
-                if self.leader_id:
-                    leader_node = None
-                    for node in self.nodes:
-                        if node["id"] == self.leader_id:
-                            leader_node = node
-                            break
-                    if leader_node:
-                        return StatusCode.REDIRECT, {
-                            "leader_host": leader_node["host"],
-                            "leader_port": leader_node["port"]
-                        }
-                return StatusCode.ERROR, {"message": "No leader available"}
-            
+                return self._not_leader_response()
+        
+        msg_type, error = self._validate_command(command)
+        if error:
+            return StatusCode.ERROR, {"message": error}
+        
+        # Each thread reads through its own connection, so reads need no
+        # lock and never wait for a batch being committed
+        if msg_type in READ_ONLY_COMMANDS:
+            conn = self._get_conn()
             try:
-                conn = sqlite3.connect(self.db_path)
-                c = conn.cursor()
-                
-                msg_type = MessageType[command["type"]]
-                data = command["data"]
-                
-                if msg_type == MessageType.CREATE_ACCOUNT:
-                    return self._handle_create_account(c, data)
-                elif msg_type == MessageType.LOGIN:
-                    return self._handle_login(c, data)
-                elif msg_type == MessageType.LOGOUT:
-                    return self._handle_logout(c, data)
-                elif msg_type == MessageType.DELETE_ACCOUNT:
-                    return self._handle_delete_account(c, data)
-                elif msg_type == MessageType.LIST_ACCOUNTS:
-                    return self._handle_list_accounts(c)
-                elif msg_type == MessageType.SEND_MESSAGE:
-                    return self._handle_send_message(c, data)
-                elif msg_type == MessageType.GET_MESSAGES:
-                    return self._handle_get_messages(c, data)
-                elif msg_type == MessageType.DELETE_MESSAGES:
-                    return self._handle_delete_messages(c, data)
-                elif msg_type == MessageType.MARK_AS_READ:
-                    return self._handle_mark_as_read(c, data)
-                else:
-                    return StatusCode.ERROR, {"message": "Unknown command"}
-                
+                return self._execute(conn.cursor(), msg_type, command["data"])
             except Exception as e:
-                logger.error(f"Error applying command: {e}")
+                logger.error("Error applying command: %s", e)
                 return StatusCode.ERROR, {"message": str(e)}
+        
+        pending = PendingCommand(command)
+        with self._pending_cv:
+            if self._closed:
+                return StatusCode.ERROR, {"message": "Node is shutting down"}
+            self._pending.append(pending)
+            self._pending_cv.notify()
+        if not pending.done.wait(APPLY_TIMEOUT):
+            return StatusCode.ERROR, {"message": "Timed out waiting for the command to commit"}
+        return pending.result
+    
+    def _validate_command(self, command: Dict) -> Tuple[Optional[MessageType], Optional[str]]:
+        """Return a client command's type, or an error if it can't be applied."""
+        try:
+            msg_type = MessageType(message_type_value(command))
+        except ValueError:
+            return None, "Unknown command"
+        fields = COMMAND_FIELDS.get(msg_type)
+        if fields is None:
+            return None, "Unknown command"
+        
+        data = command.get("data")
+        if not isinstance(data, dict):
+            return None, "Malformed command"
+        missing = [field for field in fields if field not in data]
+        if missing:
+            return None, f"Missing fields: {', '.join(missing)}"
+        if "message_ids" in fields and not (
+                isinstance(data["message_ids"], list) and
+                all(isinstance(message_id, int) for message_id in data["message_ids"])):
+            return None, "message_ids must be a list of integers"
+        return msg_type, None
+    
+    @staticmethod
+    def _request_key(command: Dict) -> Optional[Tuple[str, int]]:
+        """Return the (client_id, req_id) identifying a client write, if it has both."""
+        client_id = command.get("client_id")
+        req_id = command.get("req_id")
+        if isinstance(client_id, str) and isinstance(req_id, int):
+            return client_id, req_id
+        return None
+    
+    def _not_leader_response(self) -> Tuple[StatusCode, Optional[Dict]]:
+        """Point the client at the current leader, if one is known."""
+        leader_node = self._nodes_by_id.get(self.leader_id)
+        if leader_node:
+            return StatusCode.REDIRECT, {
+                "leader_host": leader_node["host"],
+                "leader_port": leader_node["port"]
+            }
+        return StatusCode.ERROR, {"message": "No leader available"}
+    
+    def _execute(self, c: sqlite3.Cursor, msg_type: MessageType, data: Dict) -> Tuple[StatusCode, Optional[Dict]]:
+        """Run one command's handler against the database."""
+        if msg_type == MessageType.CREATE_ACCOUNT:
+            return self._handle_create_account(c, data)
+        elif msg_type == MessageType.LOGIN:
+            return self._handle_login(c, data)
+        elif msg_type == MessageType.LOGOUT:
+            return self._handle_logout(c, data)
+        elif msg_type == MessageType.DELETE_ACCOUNT:
+            return self._handle_delete_account(c, data)
+        elif msg_type == MessageType.LIST_ACCOUNTS:
+            return self._handle_list_accounts(c)
+        elif msg_type == MessageType.SEND_MESSAGE:
+            return self._handle_send_message(c, data)
+        elif msg_type == MessageType.GET_MESSAGES:
+            return self._handle_get_messages(c, data)
+        elif msg_type == MessageType.DELETE_MESSAGES:
+            return self._handle_delete_messages(c, data)
+        elif msg_type == MessageType.MARK_AS_READ:
+            return self._handle_mark_as_read(c, data)
+        else:
+            return StatusCode.ERROR, {"message": "Unknown command"}
+    
+    def _run_applier(self) -> None:
+        """Leader thread committing queued write commands in batches.
+        
+        Commands that queued up while the previous batch was committing go
+        out together: one transaction appends them to the log and applies
+        them, and each follower gets one AppendEntries carrying the batch.
+        The AppendEntries go out before the local commit rather than after
+        it, so a batch takes as long as the slower of the two.
+        """
+        while True:
+            with self._pending_cv:
+                while not self._pending and not self._closed:
+                    self._pending_cv.wait()
+                if self._closed:
+                    batch, self._pending = self._pending, []
+                    for pending in batch:
+                        pending.result = StatusCode.ERROR, {"message": "Node is shutting down"}
+                        pending.done.set()
+                    return
+                batch = self._pending[:MAX_BATCH_SIZE]
+                del self._pending[:MAX_BATCH_SIZE]
+            
+            # Whatever happens to the batch, none of its callers is left waiting
+            try:
+                self._apply_batch(batch)
+            except Exception as e:
+                logger.error("Error applying batch: %s", e)
+                for pending in batch:
+                    pending.result = StatusCode.ERROR, {"message": str(e)}
             finally:
-                conn.close()
+                for pending in batch:
+                    pending.done.set()
+    
+    def _apply_batch(self, batch: List[PendingCommand]) -> None:
+        """Append, replicate and commit one batch, setting each command's result."""
+        with self._term_lock:
+            is_leader = self.role == NodeRole.LEADER
+            term = self.current_term
+            if not is_leader:
+                result = self._not_leader_response()
+        if not is_leader:
+            for pending in batch:
+                pending.result = result
+            return
+        
+        with self._log_lock:
+            first_index = self._last_log_index + 1
+            entries = [LogEntry(term, pending.command, first_index + i)
+                       for i, pending in enumerate(batch)]
+            self._append_log(entries)
+        
+        # Only this thread appends to the log, so the batch can be
+        # replicated and committed without holding a lock
+        committed = False
+        try:
+            replication = self._broadcast(self._send_append_entries)
+            committed = self._commit_batch(entries, batch)
+            concurrent.futures.wait(replication)
+        finally:
+            with self._log_lock:
+                if committed:
+                    self.commit_index = self.last_applied = entries[-1].index
+                else:
+                    # Never committed, so the entries must not survive in
+                    # the log or come back from the WAL file on restart
+                    self._truncate_log(first_index)
+    
+    def _commit_batch(self, entries: List[LogEntry], batch: List[PendingCommand]) -> bool:
+        """Persist a batch of log entries, then apply them in a single transaction.
+        
+        Each command runs inside its own savepoint so a failing command is
+        undone without affecting the rest of its batch. A command carrying a
+        client_id and req_id that were already applied is answered with the
+        stored result instead of running again. Returns False, with every
+        command failed, if the batch could not be made durable.
+        """
+        conn = self._get_conn()
+        c = conn.cursor()
+        try:
+            self._append_to_wal(entries)
+            c.execute("BEGIN IMMEDIATE")
+            for pending in batch:
+                request_key = self._request_key(pending.command)
+                if request_key:
+                    row = c.execute(_SQL_APPLIED_SELECT, request_key).fetchone()
+                    if row:
+                        pending.result = (StatusCode[row[0]],
+                                          decode_payload(row[1]) if row[1] is not None else None)
+                        continue
+                
+                c.execute("SAVEPOINT command")
+                try:
+                    pending.result = self._execute(
+                        c, MessageType(message_type_value(pending.command)), pending.command["data"])
+                except Exception as e:
+                    logger.error("Error applying command: %s", e)
+                    c.execute("ROLLBACK TO command")
+                    pending.result = StatusCode.ERROR, {"message": str(e)}
+                if request_key:
+                    status, data = pending.result
+                    c.execute(_SQL_APPLIED_INSERT, (*request_key, status.name,
+                                                    pack(data) if data is not None else None,
+                                                    time.time()))
+                c.execute("RELEASE command")
+            
+            if time.monotonic() >= self._next_applied_prune:
+                c.execute(_SQL_APPLIED_PRUNE, (time.time() - APPLIED_REQUEST_RETENTION,))
+                self._next_applied_prune = time.monotonic() + APPLIED_REQUEST_PRUNE_INTERVAL
+            c.execute("COMMIT")
+            return True
+            
+        except Exception as e:
+            logger.error("Error committing batch: %s", e)
+            if conn.in_transaction:
+                conn.rollback()
+            for pending in batch:
+                pending.result = StatusCode.ERROR, {"message": str(e)}
+            return False
     
     def _handle_create_account(self, c: sqlite3.Cursor, data: Dict) -> Tuple[StatusCode, Optional[Dict]]:
         """Handle account creation."""
         try:
-            c.execute("INSERT INTO accounts (username, password) VALUES (?, ?)",
-                     (data["username"], data["password"]))
-            c.connection.commit()
+            c.execute(_SQL_CREATE_ACCOUNT, (data["username"], data["password"]))
             return StatusCode.SUCCESS, None
         except sqlite3.IntegrityError:
             return StatusCode.ERROR, {"message": "Username already exists"}
     
     def _handle_login(self, c: sqlite3.Cursor, data: Dict) -> Tuple[StatusCode, Optional[Dict]]:
         """Handle login."""
-        c.execute("SELECT password FROM accounts WHERE username = ?",
-                 (data["username"],))
+        c.execute(_SQL_LOGIN_SELECT, (data["username"],))
         row = c.fetchone()
         
         if row and row[0] == data["password"]:
-            c.execute("UPDATE accounts SET last_login = CURRENT_TIMESTAMP WHERE username = ?",
-                     (data["username"],))
-            c.connection.commit()
+            c.execute(_SQL_LOGIN_UPDATE, (data["username"],))
             return StatusCode.SUCCESS, None
         return StatusCode.ERROR, {"message": "Invalid credentials"}
     
@@ -171,31 +623,23 @@ class StateMachine:
     
     def _handle_delete_account(self, c: sqlite3.Cursor, data: Dict) -> Tuple[StatusCode, Optional[Dict]]:
         """Handle account deletion."""
-        c.execute("DELETE FROM accounts WHERE username = ?", (data["username"],))
-        c.connection.commit()
+        c.execute(_SQL_DELETE_ACCOUNT, (data["username"],))
         return StatusCode.SUCCESS, None
     
     def _handle_list_accounts(self, c: sqlite3.Cursor) -> Tuple[StatusCode, Optional[Dict]]:
         """Handle account listing."""
-        c.execute("SELECT username FROM accounts")
+        c.execute(_SQL_LIST_ACCOUNTS)
         accounts = [row[0] for row in c.fetchall()]
         return StatusCode.SUCCESS, {"accounts": accounts}
     
     def _handle_send_message(self, c: sqlite3.Cursor, data: Dict) -> Tuple[StatusCode, Optional[Dict]]:
         """Handle message sending."""
-        c.execute("INSERT INTO messages (sender, recipient, content) VALUES (?, ?, ?)",
-                 (data["sender"], data["recipient"], data["content"]))
-        c.connection.commit()
+        c.execute(_SQL_INSERT_MSG, (data["sender"], data["recipient"], data["content"]))
         return StatusCode.SUCCESS, None
     
     def _handle_get_messages(self, c: sqlite3.Cursor, data: Dict) -> Tuple[StatusCode, Optional[Dict]]:
         """Handle message retrieval."""
-        c.execute("""
-            SELECT id, sender, recipient, content, timestamp, read
-            FROM messages
-            WHERE recipient = ?
-            ORDER BY timestamp DESC
-        """, (data["username"],))
+        c.execute(_SQL_GET_MSGS, (data["username"],))
         
         messages = [{
             "id": row[0],
@@ -210,18 +654,12 @@ class StateMachine:
     
     def _handle_delete_messages(self, c: sqlite3.Cursor, data: Dict) -> Tuple[StatusCode, Optional[Dict]]:
         """Handle message deletion."""
-        c.execute("DELETE FROM messages WHERE id IN ({})".format(
-            ",".join("?" * len(data["message_ids"]))),
-            data["message_ids"])
-        c.connection.commit()
+        c.executemany(_SQL_DELETE_MSG, [(message_id,) for message_id in data["message_ids"]])
         return StatusCode.SUCCESS, None
     
     def _handle_mark_as_read(self, c: sqlite3.Cursor, data: Dict) -> Tuple[StatusCode, Optional[Dict]]:
         """Handle marking messages as read."""
-        c.execute("UPDATE messages SET read = 1 WHERE id IN ({})".format(
-            ",".join("?" * len(data["message_ids"]))),
-            data["message_ids"])
-        c.connection.commit()
+        c.executemany(_SQL_MARK_READ, [(message_id,) for message_id in data["message_ids"]])
         return StatusCode.SUCCESS, None
     
     def _get_random_timeout(self) -> float:
@@ -230,66 +668,106 @@ class StateMachine:
     
     def _reset_election_timer(self) -> None:
         """Reset election timer."""
-        self.last_heartbeat = time.time()
+        self.last_heartbeat = time.monotonic()
         self.election_timeout = self._get_random_timeout()
+        self._heartbeat_event.set()
+    
+    def wait_for_heartbeat(self) -> bool:
+        """Sleep until the election deadline or a timer reset.
+        
+        Returns True if the deadline passed without a reset, i.e. it is time
+        to start an election.
+        """
+        self._heartbeat_event.clear()
+        remaining = self.last_heartbeat + self.election_timeout - time.monotonic()
+        if remaining > 0 and self._heartbeat_event.wait(remaining):
+            return False
+        if self.check_election_timeout():
+            return True
+        # Leaders never time out; check again after a full timeout
+        self._heartbeat_event.wait(self.election_timeout)
+        return False
     
     def check_election_timeout(self) -> bool:
-        """Check if election timeout has occurred."""
-        with self.lock:
-            if self.role == NodeRole.LEADER:
-                return False
-            
-            elapsed = time.time() - self.last_heartbeat
-            return elapsed > self.election_timeout
+        """Check if election timeout has occurred.
+        
+        Lock-free: a stale read at worst delays an election by one wait.
+        """
+        if self.role == NodeRole.LEADER:
+            return False
+        return time.monotonic() - self.last_heartbeat > self.election_timeout
     
     def start_election(self) -> None:
         """Start leader election."""
-        with self.lock:
+        with self._term_lock:
+            previous = self.role, self.current_term, self.voted_for
             self.role = NodeRole.CANDIDATE
             self.current_term += 1
             self.voted_for = self.node_id
-            self.votes_received = {self.node_id}
+            self.votes_received = self._vote_bits.get(self.node_id, 0)
             self._reset_election_timer()
             
-            # Persist state
-            self._persist_state()
+            # Persist state; without it the election can't be held, so back
+            # out and let the timer try again
+            try:
+                self._persist_state()
+            except sqlite3.Error as e:
+                logger.error("Not starting election, Raft state not saved: %s", e)
+                self.role, self.current_term, self.voted_for = previous
+                return
             
             # Send RequestVote RPCs
-            for node in self.nodes:
-                if node["id"] != self.node_id:
-                    self._send_request_vote(node["id"])
+            self._broadcast(self._send_request_vote)
     
     def handle_vote_request(self, term: int, candidate_id: int, 
                           last_log_index: int, last_log_term: int) -> Tuple[int, bool]:
         """Handle incoming RequestVote RPC."""
-        with self.lock:
+        # Terms only grow, so a stale candidate can be turned away unlocked
+        if term < self.current_term:
+            return self.current_term, False
+        
+        with self._term_lock:
             if term < self.current_term:
                 return self.current_term, False
             
-            if term > self.current_term:
-                self._become_follower(term)
-            
-            if (self.voted_for is None or self.voted_for == candidate_id) and \
-               self._is_log_up_to_date(last_log_index, last_log_term):
-                self.voted_for = candidate_id
-                self._persist_state()
-                return self.current_term, True
-            
+            try:
+                if term > self.current_term:
+                    self._become_follower(term)
+                
+                if (self.voted_for is None or self.voted_for == candidate_id) and \
+                   self._is_log_up_to_date(last_log_index, last_log_term):
+                    previous_vote = self.voted_for
+                    self.voted_for = candidate_id
+                    try:
+                        self._persist_state()
+                    except sqlite3.Error:
+                        self.voted_for = previous_vote
+                        raise
+                    return self.current_term, True
+                
+            except sqlite3.Error as e:
+                # A vote only counts once it is on disk
+                logger.error("Declining vote, Raft state not saved: %s", e)
             return self.current_term, False
     
     def handle_vote_response(self, term: int, voter_id: int, granted: bool) -> None:
         """Handle vote response."""
-        with self.lock:
-            if self.role != NodeRole.CANDIDATE or term != self.current_term:
-                return
-            
+        # Late votes from an earlier election can be dropped unlocked
+        if term < self.current_term:
+            return
+        
+        with self._term_lock:
+            # A newer term always demotes us, even once the election is over
             if term > self.current_term:
                 self._become_follower(term)
                 return
             
+            if self.role != NodeRole.CANDIDATE or term != self.current_term:
+                return
+            
             if granted:
-                self.votes_received.add(voter_id)
-                if len(self.votes_received) > len(self.nodes) // 2:
+                self.votes_received |= self._vote_bits.get(voter_id, 0)
+                if self.votes_received.bit_count() > len(self.nodes) // 2:
                     self._become_leader()
     
     def _become_follower(self, term: int) -> None:
@@ -307,59 +785,113 @@ class StateMachine:
         self.leader_id = self.node_id
         
         # Initialize leader state
-        last_log_index = len(self.log)
-        self.next_index = {node["id"]: last_log_index + 1 for node in self.nodes}
-        self.match_index = {node["id"]: 0 for node in self.nodes}
+        last_log_index = self._last_log_index + 1
+        for node_id in self.next_index:
+            self.next_index[node_id] = last_log_index + 1
+            self.match_index[node_id] = 0
         
         # Send initial empty AppendEntries
         self._send_heartbeat()
     
     def _is_log_up_to_date(self, last_log_index: int, last_log_term: int) -> bool:
         """Check if candidate's log is at least as up-to-date as receiver's log."""
-        if not self.log:
+        with self._log_lock:
+            our_last_index = self._last_log_index
+            our_last_term = self._last_log_term
+        if our_last_index < 0:
             return True
         
-        our_last_term = self.log[-1].term
-        our_last_index = len(self.log) - 1
-        
         if last_log_term != our_last_term:
             return last_log_term > our_last_term
         return last_log_index >= our_last_index
     
-    def _persist_state(self) -> None:
-        """Persist Raft state to disk."""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+    def _append_log(self, entries: List[LogEntry]) -> None:
+        """Append entries to the in-memory log. Caller holds _log_lock."""
+        if entries:
+            self.log.extend(entries)
+            self._last_log_index = len(self.log) - 1
+            self._last_log_term = entries[-1].term
+    
+    def _truncate_log(self, to_index: int) -> None:
+        """Drop the log entries from to_index on, in memory and in the WAL file.
         
-        # Update Raft state
-        c.execute("DELETE FROM raft_state")
-        c.execute("INSERT INTO raft_state (current_term, voted_for) VALUES (?, ?)",
-                 (self.current_term, self.voted_for))
+        Caller holds _log_lock. Also cuts any partial record a failed write
+        left past the last complete one.
+        """
+        if to_index < len(self._wal_offsets):
+            self._wal_end = self._wal_offsets[to_index]
+            del self._wal_offsets[to_index:]
+        self._wal.truncate(self._wal_end)
+        _fdatasync(self._wal.fileno())
         
-        conn.commit()
-        conn.close()
+        del self.log[to_index:]
+        self._last_log_index = len(self.log) - 1
+        self._last_log_term = self.log[-1].term if self.log else 0
+    
+    def _persist_state(self, wait: bool = True) -> None:
+        """Persist Raft state to disk.
+        
+        Raft must not answer an RPC before its term and vote are durable, so
+        by default this blocks until the writer thread has committed them,
+        and raises the writer's sqlite3.Error if it could not.
+        """
+        saved = concurrent.futures.Future()
+        self._persist_queue.put((self.current_term, self.voted_for, saved))
+        if wait:
+            saved.result()
+    
+    def _run_persister(self) -> None:
+        """Writer thread committing queued Raft state, one sync per burst."""
+        conn = self._open_conn()
+        # Term and vote must survive a power loss, unlike the chat tables
+        conn.execute("PRAGMA synchronous=FULL")
+        
+        while True:
+            batch = [self._persist_queue.get()]
+            time.sleep(PERSIST_SYNC_INTERVAL)
+            while True:
+                try:
+                    batch.append(self._persist_queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            # Only the newest state matters; earlier ones are superseded
+            term, voted_for, _ = batch[-1]
+            try:
+                conn.execute(_SQL_SAVE_RAFT_STATE, (term, voted_for))
+            except sqlite3.Error as e:
+                logger.error("Error persisting Raft state: %s", e)
+                for _, _, saved in batch:
+                    saved.set_exception(e)
+            else:
+                for _, _, saved in batch:
+                    saved.set_result(None)
     
     def _send_request_vote(self, target_id: int) -> None:
         """Send RequestVote RPC to target node."""
-        last_log_index = len(self.log) - 1
-        last_log_term = self.log[last_log_index].term if self.log else 0
+        with self._log_lock:
+            last_log_index = self._last_log_index
+            last_log_term = self._last_log_term
         
         # This would be implemented by the node server to actually send the RPC
         pass
     
+    def _broadcast(self, rpc: Callable[[int], None]) -> List[concurrent.futures.Future]:
+        """Send an RPC to every peer concurrently, one pool worker each."""
+        return [self._replication_pool.submit(rpc, node["id"]) for node in self._peers]
+    
     def _send_heartbeat(self) -> None:
         """Send heartbeat (empty AppendEntries) to all followers."""
-        for node in self.nodes:
-            if node["id"] != self.node_id:
-                self._send_append_entries(node["id"])
+        self._broadcast(self._send_append_entries)
     
     def _send_append_entries(self, target_id: int) -> None:
         """Send AppendEntries RPC to target node."""
-        prev_log_index = self.next_index[target_id] - 1
-        prev_log_term = self.log[prev_log_index].term if prev_log_index >= 0 and self.log else 0
-        
-        # Get entries to send
-        entries = self.log[self.next_index[target_id]:]
+        with self._log_lock:
+            prev_log_index = self.next_index[target_id] - 1
+            prev_log_term = self.log[prev_log_index].term if prev_log_index >= 0 and self.log else 0
+            
+            # Get entries to send
+            entries = self.log[self.next_index[target_id]:]
         
         # This would be implemented by the node server to actually send the RPC
         pass
@@ -1,9 +1,19 @@
 import json
 import enum
+import socket
+import struct
+import threading
+import weakref
 from datetime import datetime
 from typing import Optional, Dict, List, Any, Union
 import logging
 
+# orjson is optional; it encodes and decodes several times faster than json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Configure logging
 logging.basicConfig(
     level=logging.DEBUG,
@@ -41,59 +51,138 @@ class StatusCode(enum.Enum):
 
 def create_message(msg_type: MessageType, data: Dict[str, Any], status: StatusCode = StatusCode.PENDING) -> Dict[str, Any]:
     """Create a properly formatted message with the given type and data."""
-    logger.debug(f"Creating message of type {msg_type.value} with data: {data}")
+    logger.debug("Creating message of type %s with data: %s", msg_type.value, data)
     message = {
         "type": msg_type.value,
         "data": data,
         "timestamp": datetime.utcnow().isoformat(),
         "status": status.value
     }
-    logger.debug(f"Created message: {message}")
+    logger.debug("Created message: %s", message)
     return message
 
 
+# Fixed part of every server-pushed BROADCAST frame
+_BROADCAST_HEADER = {
+    "type": MessageType.BROADCAST.value,
+    "status": StatusCode.SUCCESS.value
+}
+
+
+def create_broadcast(data: Dict[str, Any], timestamp: Optional[str] = None) -> Dict[str, Any]:
+    """Create a BROADCAST message; a fast path of create_message for the push loops.
+    
+    Loops sending many frames at once can pass one shared timestamp.
+    """
+    if timestamp is None:
+        timestamp = datetime.utcnow().isoformat()
+    return {**_BROADCAST_HEADER, "data": data, "timestamp": timestamp}
+
+
+# Built once so validate_message checks membership without enum lookups
+_REQUIRED_FIELDS = frozenset({"type", "data", "timestamp", "status"})
+_TYPE_VALUES = frozenset(msg_type.value for msg_type in MessageType)
+_STATUS_VALUES = frozenset(status.value for status in StatusCode)
+
+
+def _is_member(value: Any, values: frozenset) -> bool:
+    """Membership test that treats unhashable JSON values (lists, objects) as absent."""
+    try:
+        return value in values
+    except TypeError:
+        return False
+
+
 def validate_message(message: Dict[str, Any]) -> bool:
     """Validate that a message has all required fields and correct format."""
-    logger.debug(f"Validating message: {message}")
-    
-    required_fields = {"type", "data", "timestamp", "status"}
+    logger.debug("Validating message: %s", message)
     
     # Check all required fields exist
-    if not all(field in message for field in required_fields):
-        logger.error(f"Message missing required fields. Required: {required_fields}, Got: {message.keys()}")
+    if not _REQUIRED_FIELDS.issubset(message):
+        logger.error("Message missing required fields. Required: %s, Got: %s", set(_REQUIRED_FIELDS), message.keys())
         return False
     
     # Validate message type
-    try:
-        MessageType(message["type"])
-    except ValueError:
-        logger.error(f"Invalid message type: {message['type']}")
+    if not _is_member(message["type"], _TYPE_VALUES):
+        logger.error("Invalid message type: %s", message['type'])
         return False
     
     # Validate status
-    try:
-        StatusCode(message["status"])
-    except ValueError:
-        logger.error(f"Invalid status code: {message['status']}")
+    if not _is_member(message["status"], _STATUS_VALUES):
+        logger.error("Invalid status code: %s", message['status'])
         return False
     
     # Validate data is dict
     if not isinstance(message["data"], dict):
-        logger.error(f"Data must be a dictionary, got: {type(message['data'])}")
+        logger.error("Data must be a dictionary, got: %s", type(message['data']))
         return False
     
     logger.debug("Message validation successful")
     return True
 
 
+# Compact encoding: no padding after separators and no \uXXXX escapes
+_JSON_SEPARATORS = (",", ":")
+
+# Frames are a 4-byte big-endian payload length followed by the JSON payload.
+# A frame starting with '{' instead is a legacy newline-delimited frame.
+FRAME_HEADER = struct.Struct(">I")
+_LEGACY_FRAME_START = ord("{")
+# Largest payload a peer may announce; anything bigger means a corrupt stream
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize an object to compact UTF-8 JSON, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=_JSON_SEPARATORS, ensure_ascii=False).encode('utf-8')
+
+
+def loads(data: Union[bytes, memoryview, str]) -> Any:
+    """Parse JSON from bytes, a memoryview or str, using orjson when available.
+    
+    orjson parses a memoryview in place; the json fallback decodes it
+    straight to str rather than copying it to bytes first.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = str(data, 'utf-8')
+    return json.loads(data)
+
+
+def encode_payload(obj: Dict[str, Any]) -> bytes:
+    """Validate a message and encode its JSON payload, without the frame header."""
+    if not validate_message(obj):
+        raise ValueError("Invalid message format")
+    return dumps(obj)
+
+
+def encode_json(obj: Dict[str, Any]) -> bytes:
+    """Validate a message and encode it as a length-prefixed wire frame."""
+    payload = encode_payload(obj)
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def configure_socket(sock):
+    """Disable Nagle's algorithm; every frame is written with a single send."""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        # Not a TCP socket (e.g. a socketpair)
+        pass
+
+
 def send_json(sock, obj: Dict[str, Any]) -> Optional[str]:
-    """Send a JSON object over the socket, appending a newline as delimiter."""
+    """Send a JSON object over the socket as one length-prefixed frame."""
     try:
-        logger.debug(f"Attempting to send JSON object: {obj}")
-        if not validate_message(obj):
-            raise ValueError("Invalid message format")
-        msg = json.dumps(obj) + "\n"
-        sock.sendall(msg.encode('utf-8'))
+        logger.debug("Attempting to send JSON object: %s", obj)
+        payload = encode_payload(obj)
+        # Header and payload leave in one gathered write, without joining them
+        error = send_frames(sock, [FRAME_HEADER.pack(len(payload)), payload])
+        if error:
+            return error
         logger.debug("Message sent successfully")
         return None
     except Exception as e:
@@ -102,22 +191,234 @@ def send_json(sock, obj: Dict[str, Any]) -> Optional[str]:
         return error_msg
 
 
+# Most bytes a socket may have queued behind its writer before non-blocking
+# sends to it are refused
+MAX_PENDING_BYTES = 4 * 1024 * 1024
+
+
+class _SendState:
+    """Per-socket writer state.
+    
+    busy is set while one thread is writing to the socket. pending holds
+    bytes waiting to be written after it: frames queued by non-blocking
+    senders that found the socket busy, and the unsent tail of a partial
+    non-blocking write. lock guards both and is never held across a send.
+    """
+    
+    __slots__ = ("lock", "idle", "busy", "pending")
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.busy = False
+        self.pending = bytearray()
+
+
+# One send state per socket, dropped automatically when the socket is collected
+_send_states = weakref.WeakKeyDictionary()
+_send_states_lock = threading.Lock()
+
+
+def _get_send_state(sock) -> _SendState:
+    state = _send_states.get(sock)
+    if state is None:
+        with _send_states_lock:
+            state = _send_states.get(sock)
+            if state is None:
+                state = _send_states[sock] = _SendState()
+    return state
+
+
+def _write(sock, parts: List[bytes], block: bool) -> bytes:
+    """Write parts with one gathered send; return what a non-blocking write left unsent."""
+    if not hasattr(sock, "sendmsg"):
+        sock.sendall(b"".join(parts))
+        return b""
+    try:
+        sent = sock.sendmsg(parts, [], 0 if block else getattr(socket, "MSG_DONTWAIT", 0))
+    except BlockingIOError:
+        sent = 0
+    if sent == sum(len(part) for part in parts):
+        return b""
+    rest = b"".join(parts)[sent:]
+    if block:
+        sock.sendall(rest)
+        return b""
+    return rest
+
+
+def send_frames(sock, frames: List[bytes], block: bool = True) -> Optional[str]:
+    """Send already-encoded frames with a single gathered write.
+    
+    Writers to one socket are serialized, so frames from different threads
+    never interleave. With block=False the call never waits: if another
+    thread is writing, the frames are queued for that thread to send next,
+    and if the peer's send buffer is full the unsent tail is kept for the
+    next send to the socket. Frames are only refused, with an error, once
+    MAX_PENDING_BYTES are already queued.
+    """
+    state = _get_send_state(sock)
+    with state.lock:
+        if state.busy and not block:
+            if len(state.pending) > MAX_PENDING_BYTES:
+                return "Send buffer full"
+            for frame in frames:
+                state.pending += frame
+            return None
+        while state.busy:
+            state.idle.wait()
+        state.busy = True
+        parts = [bytes(state.pending), *frames] if state.pending else list(frames)
+        state.pending = bytearray()
+    
+    try:
+        while True:
+            rest = _write(sock, parts, block)
+            with state.lock:
+                if rest:
+                    # The tail goes out before anything queued meanwhile
+                    state.pending[:0] = rest
+                if rest or not state.pending:
+                    state.busy = False
+                    state.idle.notify()
+                    return None
+                parts = [bytes(state.pending)]
+                state.pending = bytearray()
+    except Exception as e:
+        with state.lock:
+            # The stream is broken; nothing queued on it can be delivered
+            state.pending = bytearray()
+            state.busy = False
+            state.idle.notify()
+        error_msg = f"Error sending frames: {e}"
+        logger.error(error_msg)
+        return error_msg
+
+
+class FrameError(ValueError):
+    """The byte stream does not contain a valid frame and cannot be resynced."""
+
+
+class JsonFramer:
+    """Persistent receive buffer that splits a socket's byte stream into frames.
+    
+    Data is read with recv_into straight into one preallocated buffer; the
+    unconsumed bytes are the span [start, end). Bytes read past the end of
+    one frame stay buffered for the next call. The socket is passed to each
+    read rather than stored, so a framer never keeps its socket alive.
+    """
+    
+    RECV_SIZE = 65536
+    
+    def __init__(self):
+        self.buffer = bytearray(self.RECV_SIZE)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+    
+    def _make_room(self, size: int):
+        """Ensure the buffer can hold size unconsumed bytes plus free space after them."""
+        pending = self.end - self.start
+        if pending + self.RECV_SIZE > len(self.buffer) or size > len(self.buffer):
+            # Grow; a bytearray with a live memoryview can't be resized in place
+            capacity = max(2 * len(self.buffer), size + self.RECV_SIZE)
+            buffer = bytearray(capacity)
+            buffer[:pending] = self.view[self.start:self.end]
+            self.view.release()
+            self.buffer, self.view = buffer, memoryview(buffer)
+        else:
+            # Slide the pending bytes to the front
+            self.buffer[:pending] = self.view[self.start:self.end]
+        self.start, self.end = 0, pending
+    
+    def _fill(self, sock, size: int) -> bool:
+        """Read until at least size bytes are unconsumed; False if the peer closed."""
+        while self.end - self.start < size:
+            if self.start + size > len(self.buffer) or self.end == len(self.buffer):
+                self._make_room(size)
+            received = sock.recv_into(self.view[self.end:])
+            if not received:
+                return False
+            self.end += received
+        return True
+    
+    def _consume(self, length: int, skip: int = 0) -> memoryview:
+        """Return a view of the next length unconsumed bytes and drop them plus skip more.
+        
+        The view aliases the receive buffer, so it is only valid until the
+        next read.
+        """
+        frame = self.view[self.start:self.start + length]
+        self.start += length + skip
+        if self.start == self.end:
+            self.start = self.end = 0
+        return frame
+    
+    def _read_legacy_frame(self, sock) -> Optional[memoryview]:
+        """Return the next newline-delimited frame, or None if the peer closed."""
+        # Only scan bytes that haven't been searched for a delimiter yet
+        scanned = 0
+        while True:
+            newline = self.buffer.find(b"\n", self.start + scanned, self.end)
+            if newline != -1:
+                break
+            scanned = self.end - self.start
+            if scanned > MAX_FRAME_SIZE:
+                raise FrameError(f"No frame delimiter within {MAX_FRAME_SIZE} bytes")
+            if not self._fill(sock, scanned + 1):
+                return None
+        return self._consume(newline - self.start, skip=1)
+    
+    def read_frame(self, sock) -> Optional[memoryview]:
+        """Return a view of the next frame's payload, or None if the peer closed."""
+        if not self._fill(sock, 1):
+            return None
+        if self.buffer[self.start] == _LEGACY_FRAME_START:
+            return self._read_legacy_frame(sock)
+        
+        header_size = FRAME_HEADER.size
+        if not self._fill(sock, header_size):
+            return None
+        (length,) = FRAME_HEADER.unpack_from(self.buffer, self.start)
+        if length > MAX_FRAME_SIZE:
+            raise FrameError(f"Frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+        if not self._fill(sock, header_size + length):
+            return None
+        self.start += header_size
+        return self._consume(length)
+
+
+# One framer per socket, dropped automatically when the socket is collected
+_framers = weakref.WeakKeyDictionary()
+
+
 def recv_json(sock) -> Union[Dict[str, Any], str, None]:
-    """Receive a JSON object from the socket assuming each message is newline delimited."""
+    """Receive one framed JSON object from the socket.
+    
+    Returns None when the peer closed the connection or the stream is corrupt,
+    and an error string when a single message could not be decoded.
+    """
     try:
         logger.debug("Attempting to receive JSON message")
-        # Create a file-like object to read one line at a time
-        f = sock.makefile('r')
-        line = f.readline()
-        if not line:
-            logger.warning("Received empty line")
+        framer = _framers.get(sock)
+        if framer is None:
+            framer = _framers[sock] = JsonFramer()
+        frame = framer.read_frame(sock)
+        if frame is None:
+            logger.warning("Connection closed by peer")
             return None
-        logger.debug(f"Received raw message: {line}")
-        message = json.loads(line)
+        logger.debug("Received %s byte frame", len(frame))
+        # Parse straight out of the receive buffer, then drop the view
+        with frame:
+            message = loads(frame)
         if not validate_message(message):
             raise ValueError("Received invalid message format")
-        logger.debug(f"Successfully received and validated message: {message}")
+        logger.debug("Successfully received and validated message: %s", message)
         return message
+    except FrameError as e:
+        # The stream can't be resynced, so treat it like a closed connection
+        logger.error("Dropping connection: %s", e)
+        return None
     except Exception as e:
         error_msg = f"Error receiving JSON: {e}"
         logger.error(error_msg)
@@ -127,7 +428,7 @@ def recv_json(sock) -> Union[Dict[str, Any], str, None]:
 # Helper functions for common message creation
 def create_error(message: str) -> Dict[str, Any]:
     """Create an error message."""
-    logger.debug(f"Creating error message: {message}")
+    logger.debug("Creating error message: %s", message)
     return create_message(
         MessageType.ERROR,
         {"message": message},
@@ -137,7 +438,7 @@ def create_error(message: str) -> Dict[str, Any]:
 
 def create_ack(message_id: str) -> Dict[str, Any]:
     """Create an acknowledgment message."""
-    logger.debug(f"Creating acknowledgment message for message_id: {message_id}")
+    logger.debug("Creating acknowledgment message for message_id: %s", message_id)
     return create_message(
         MessageType.ACK,
         {"message_id": message_id},
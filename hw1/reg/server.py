@@ -2,13 +2,19 @@ import socket
 import sqlite3
 import threading
 import hashlib
+import hmac
+import base64
 import json
 import logging
-from datetime import datetime
 import protocol as protocol
 from protocol import MessageType, StatusCode
 import time
 import os
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
 
 # Configure logging
 logging.basicConfig(
@@ -27,7 +33,8 @@ CONFIG_FILE = os.path.join(BASE_DIR, "server_config.json")
 default_config = {
     "host": "0.0.0.0",
     "port": 12345,
-    "db_path": "chat.db"
+    "db_path": "chat.db",
+    "log_level": "INFO"
 }
 if os.path.isfile(CONFIG_FILE):
     with open(CONFIG_FILE, "r") as f:
@@ -35,7 +42,7 @@ if os.path.isfile(CONFIG_FILE):
     # Merge user_config with default_config
     config = {**default_config, **user_config}
 else:
-    logger.warning(f"No config file found at {CONFIG_FILE}. Using defaults.")
+    logger.warning("No config file found at %s. Using defaults.", CONFIG_FILE)
     config = default_config
 
 HOST = config["host"]
@@ -44,17 +51,101 @@ DB_PATH = config["db_path"]
 
 # Global variables
 server_socket = None
-db_conn = None
-cursor = None
 # Dictionary to store active client connections: {username: (conn, last_broadcast_time)}
 active_clients = {}
+# Guards every read and write of active_clients across handler and broadcast threads
+active_clients_lock = threading.RLock()
+
+# Updates are pushed as they happen; this periodic full resync only repairs
+# clients that missed a push (e.g. a skipped non-blocking write)
+BROADCAST_INTERVAL = 60
+# Number of recent messages pushed to each client per broadcast
+RECENT_MESSAGES_LIMIT = 50
+# Client handler threads only block on socket reads and short SQLite calls, so
+# they need a small fraction of the default 8 MB stack.
+CLIENT_THREAD_STACK_SIZE = 512 * 1024
+# Each worker serves one client connection for its whole session, so
+# connections beyond this are refused rather than queued behind sessions that
+# may never end
+MAX_CLIENT_WORKERS = min(256, (os.cpu_count() or 1) * 32)
+# Every accepted socket, so shutdown can unblock workers waiting on recv
+client_sockets = set()
+# Serializes write transactions across client threads
+db_write_lock = threading.Lock()
+# Set when the server shuts down so background threads exit promptly
+shutdown_event = threading.Event()
+
+# Password hashing: scrypt parameters and the prefix marking scrypt hashes,
+# stored as base64(salt + key)
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_SALT_BYTES = 16
+SCRYPT_KEY_BYTES = 32
+SCRYPT_PREFIX = "scrypt$"
+# Recent successful verifications, so repeat logins skip scrypt. Keys pair the
+# stored hash with a keyed digest of the password; no plaintext is cached, and
+# a changed hash never matches. Failures are not cached and always pay scrypt.
+VERIFY_CACHE_SIZE = 4096
+_verify_cache = OrderedDict()
+_verify_cache_lock = threading.Lock()
+_VERIFY_CACHE_KEY = os.urandom(32)
+# Login throttling: after this many failures within the window, further
+# attempts for the account are refused without running scrypt
+LOGIN_MAX_FAILURES = 5
+LOGIN_FAILURE_WINDOW = 60
+# {username: (first_failure_time, failure_count)}
+_login_failures = {}
+_login_failures_lock = threading.Lock()
+
+# Per-connection SQLite tuning. With the WAL journal enabled in init_db,
+# synchronous=NORMAL only syncs at checkpoints instead of on every commit.
+DB_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+    # Lets the messages foreign keys reject unknown senders and recipients
+    "PRAGMA foreign_keys=ON",
+)
+
+def open_db_connection() -> sqlite3.Connection:
+    """Open a tuned connection to the chat database that can be reused across requests.
+    
+    The connection is in autocommit mode: reads never hold a transaction open,
+    and handle_client wraps write requests in an explicit BEGIN IMMEDIATE.
+    """
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256, isolation_level=None)
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+# Each thread keeps one connection for its lifetime
+_tls = threading.local()
+
+def get_thread_connection() -> sqlite3.Connection:
+    """Return this thread's database connection, opening it on first use."""
+    conn = getattr(_tls, "conn", None)
+    if conn is None:
+        conn = _tls.conn = open_db_connection()
+    return conn
+
+def close_thread_connection():
+    """Close this thread's database connection, if it has one."""
+    conn = getattr(_tls, "conn", None)
+    if conn is not None:
+        _tls.conn = None
+        conn.close()
 
 def init_db():
     """Initialize the SQLite database with required tables."""
     logger.info("Initializing database...")
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = open_db_connection()
         c = conn.cursor()
+        # WAL is persistent, so setting it once here covers every later connection
+        c.execute("PRAGMA journal_mode=WAL")
         c.execute('''CREATE TABLE IF NOT EXISTS accounts (
                     username TEXT PRIMARY KEY,
                     password TEXT NOT NULL,
@@ -72,10 +163,28 @@ def init_db():
                     FOREIGN KEY (sender) REFERENCES accounts(username),
                     FOREIGN KEY (recipient) REFERENCES accounts(username)
                  )''')
+        # Serves the "latest messages for a recipient" scans in the broadcasts and get_messages
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_messages_recipient_ts
+                     ON messages(recipient, timestamp DESC)''')
+        # Partial index holding only unread rows; serves the unread counts at login
+        # and account deletion without touching read history
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_messages_unread
+                     ON messages(recipient) WHERE read = 0''')
+        # Lets the account-deletion sweep find sent messages without a table scan
+        c.execute('''CREATE INDEX IF NOT EXISTS idx_messages_sender
+                     ON messages(sender)''')
+        # Sweep a user's messages as part of deleting their account, so account
+        # deletion is a single statement
+        c.execute('''CREATE TRIGGER IF NOT EXISTS trg_accounts_delete_messages
+                     BEFORE DELETE ON accounts
+                     BEGIN
+                         DELETE FROM messages
+                         WHERE sender = OLD.username OR recipient = OLD.username;
+                     END''')
         conn.commit()
         logger.info("Database initialized successfully")
     except Exception as e:
-        logger.error(f"Database initialization failed: {e}")
+        logger.error("Database initialization failed: %s", e)
         raise
     finally:
         conn.close()
@@ -98,142 +207,271 @@ def migrate_database():
             logger.info("Database migration completed successfully")
         
     except Exception as e:
-        logger.error(f"Database migration failed: {e}")
+        logger.error("Database migration failed: %s", e)
         raise
     finally:
         conn.close()
 
-def hash_password(password: str) -> str:
-    """Hash a password using SHA-256."""
-    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+def _password_bytes(password: Union[str, bytes]) -> bytes:
+    """Return the password as UTF-8 bytes; bytes are passed through unencoded."""
+    return password if isinstance(password, bytes) else password.encode('utf-8')
+
+def _scrypt(password: bytes, salt: bytes) -> bytes:
+    """Derive a password key with scrypt."""
+    return hashlib.scrypt(
+        password,
+        salt=salt,
+        n=SCRYPT_N,
+        r=SCRYPT_R,
+        p=SCRYPT_P,
+        dklen=SCRYPT_KEY_BYTES
+    )
+
+def hash_password(password: Union[str, bytes]) -> str:
+    """Hash a password with a random salt using scrypt."""
+    salt = os.urandom(SCRYPT_SALT_BYTES)
+    encoded = base64.b64encode(salt + _scrypt(_password_bytes(password), salt)).decode('ascii')
+    return SCRYPT_PREFIX + encoded
+
+def verify_password(password: Union[str, bytes], stored_hash: str) -> bool:
+    """Check a password against a stored hash.
+    
+    Accounts created before scrypt hashing store a bare SHA-256 hex digest,
+    which is still accepted.
+    """
+    # Encode once; every hash below works on the same bytes
+    password = _password_bytes(password)
+    if not stored_hash.startswith(SCRYPT_PREFIX):
+        legacy_hash = hashlib.sha256(password).hexdigest()
+        return hmac.compare_digest(stored_hash, legacy_hash)
+    
+    cache_key = (
+        stored_hash,
+        hashlib.blake2b(password, key=_VERIFY_CACHE_KEY).digest()
+    )
+    with _verify_cache_lock:
+        if cache_key in _verify_cache:
+            _verify_cache.move_to_end(cache_key)
+            return True
+    
+    raw = base64.b64decode(stored_hash[len(SCRYPT_PREFIX):])
+    salt, key = raw[:SCRYPT_SALT_BYTES], raw[SCRYPT_SALT_BYTES:]
+    if not hmac.compare_digest(key, _scrypt(password, salt)):
+        return False
+    
+    with _verify_cache_lock:
+        _verify_cache[cache_key] = True
+        if len(_verify_cache) > VERIFY_CACHE_SIZE:
+            _verify_cache.popitem(last=False)
+    return True
+
+def login_throttled(username: str) -> bool:
+    """Return whether the account has failed too many logins in the current window."""
+    with _login_failures_lock:
+        if username not in _login_failures:
+            return False
+        first_failure, count = _login_failures[username]
+        if time.monotonic() - first_failure > LOGIN_FAILURE_WINDOW:
+            _login_failures.pop(username, None)
+            return False
+        return count >= LOGIN_MAX_FAILURES
+
+def record_login_result(username: str, success: bool):
+    """Count a failed login for the account, or clear its failures on success."""
+    with _login_failures_lock:
+        if success:
+            _login_failures.pop(username, None)
+            return
+        now = time.monotonic()
+        first_failure, count = _login_failures.get(username, (now, 0))
+        if now - first_failure > LOGIN_FAILURE_WINDOW:
+            first_failure, count = now, 0
+        _login_failures[username] = (first_failure, count + 1)
+
+def rows_as_dicts(c: sqlite3.Cursor) -> list:
+    """Fetch the remaining rows of a query as dicts keyed by column name."""
+    columns = [column[0] for column in c.description]
+    return [dict(zip(columns, row)) for row in c.fetchall()]
+
+@lru_cache(maxsize=128)
+def recent_messages_sql(recipient_count: int) -> str:
+    """Build the recent-messages query for recipient_count recipients.
+    
+    Cached so each recipient count builds its placeholder list once and
+    always passes SQLite's statement cache the same string.
+    """
+    placeholders = ','.join('?' * recipient_count)
+    return f"""
+        SELECT id, sender, recipient, content, timestamp
+        FROM (
+            SELECT id, sender, recipient, content, timestamp,
+                   ROW_NUMBER() OVER (PARTITION BY recipient ORDER BY timestamp DESC) AS rn
+            FROM messages
+            WHERE recipient IN ({placeholders})
+        )
+        WHERE rn <= ?
+        ORDER BY recipient, rn
+    """
+
+def fetch_recent_messages(c: sqlite3.Cursor, usernames: list) -> dict:
+    """Fetch the latest messages for each recipient in a single query, grouped by recipient."""
+    recent = {username: [] for username in usernames}
+    if not usernames:
+        return recent
+    
+    c.execute(recent_messages_sql(len(usernames)), (*usernames, RECENT_MESSAGES_LIMIT))
+    
+    for msg in rows_as_dicts(c):
+        recent[msg["recipient"]].append(msg)
+    return recent
 
 def broadcast_updates():
-    """Broadcast updates to all connected clients."""
-    while True:
-        try:
-            time.sleep(5)  # Broadcast every 5 seconds
-            with threading.Lock():
+    """Periodically resync full state to all connected clients."""
+    # This thread gets its own connection; SQLite objects can't be shared across threads
+    conn = get_thread_connection()
+    c = conn.cursor()
+    try:
+        while not shutdown_event.wait(BROADCAST_INTERVAL):
+            try:
+                # Take one immutable snapshot per tick under the lock, then send
+                # outside it so a slow client doesn't block logins and logouts
+                with active_clients_lock:
+                    snapshot = tuple(active_clients.items())
+                
                 # Get all online users
-                online_users = list(active_clients.keys())
+                online_users = [username for username, _ in snapshot]
+                recent_messages = fetch_recent_messages(c, online_users)
+                
+                # The user list is the same for everyone, so encode it once per
+                # tick; every frame in the tick shares one timestamp
+                timestamp = datetime.utcnow().isoformat()
+                users_frame = protocol.encode_json(protocol.create_broadcast({
+                    "type": "users",
+                    "users": online_users
+                }, timestamp))
                 
                 # Create broadcast message
-                for username, (conn, _) in active_clients.items():
+                for username, (client_socket, _) in snapshot:
                     try:
-                        # Send user list update
-                        users_msg = protocol.create_message(
-                            MessageType.BROADCAST,
-                            {
-                                "type": "users",
-                                "users": online_users
-                            }
-                        )
-                        protocol.send_json(conn, users_msg)
-                        
-                        # Send messages update
-                        cursor.execute("""
-                            SELECT m.id, m.sender, m.recipient, m.content, m.timestamp
-                            FROM messages m
-                            WHERE m.recipient = ?
-                            ORDER BY m.timestamp DESC
-                            LIMIT 50
-                        """, (username,))
-                        messages = cursor.fetchall()
+                        # Messages update
+                        msg_msg = protocol.create_broadcast({
+                            "type": "messages",
+                            "messages": recent_messages.get(username, [])
+                        }, timestamp)
                         
-                        messages_list = [
-                            {
-                                "id": msg[0],
-                                "sender": msg[1],
-                                "recipient": msg[2],
-                                "content": msg[3],
-                                "timestamp": msg[4]
-                            }
-                            for msg in messages
-                        ]
-                        
-                        msg_msg = protocol.create_message(
-                            MessageType.BROADCAST,
-                            {
-                                "type": "messages",
-                                "messages": messages_list
-                            }
+                        # Both frames go out in one non-blocking write, so a slow
+                        # client never stalls everyone else; whatever doesn't fit
+                        # stays queued on its socket.
+                        error = protocol.send_frames(
+                            client_socket,
+                            [users_frame, protocol.encode_json(msg_msg)],
+                            block=False
                         )
-                        protocol.send_json(conn, msg_msg)
+                        if error:
+                            logger.warning("Skipped broadcast to %s: %s", username, error)
                         
                     except Exception as e:
-                        logger.error(f"Error broadcasting to {username}: {e}")
+                        logger.error("Error broadcasting to %s: %s", username, e)
                         
-        except Exception as e:
-            logger.error(f"Error in broadcast thread: {e}")
+            except Exception as e:
+                logger.error("Error in broadcast thread: %s", e)
+    finally:
+        close_thread_connection()
 
-def broadcast_to_user(username: str):
+def broadcast_to_user(username: str, c: sqlite3.Cursor):
     """Send updates to a specific user."""
-    if username not in active_clients:
-        return
-        
-    user_socket = active_clients[username][0]
+    with active_clients_lock:
+        if username not in active_clients:
+            return
+        user_socket = active_clients[username][0]
+        online_users = list(active_clients.keys())
+    
     try:
-        # Send messages update
-        cursor.execute("""
-            SELECT m.id, m.sender, m.recipient, m.content, m.timestamp
-            FROM messages m
-            WHERE m.recipient = ?
-            ORDER BY m.timestamp DESC
-            LIMIT 50
-        """, (username,))
-        messages = cursor.fetchall()
+        # Messages update
+        messages_list = fetch_recent_messages(c, [username])[username]
         
-        messages_list = [
-            {
-                "id": msg[0],
-                "sender": msg[1],
-                "recipient": msg[2],
-                "content": msg[3],
-                "timestamp": msg[4]
-            }
-            for msg in messages
-        ]
+        timestamp = datetime.utcnow().isoformat()
+        msg_msg = protocol.create_broadcast({
+            "type": "messages",
+            "messages": messages_list
+        }, timestamp)
         
-        msg_msg = protocol.create_message(
-            MessageType.BROADCAST,
-            {
-                "type": "messages",
-                "messages": messages_list
-            }
-        )
-        protocol.send_json(user_socket, msg_msg)
+        # Online users update
+        users_msg = protocol.create_broadcast({
+            "type": "users",
+            "users": online_users
+        }, timestamp)
         
-        # Send online users update
-        users_msg = protocol.create_message(
-            MessageType.BROADCAST,
-            {
-                "type": "users",
-                "users": list(active_clients.keys())
-            }
+        # Both frames go out in one gathered write instead of two sends. This
+        # runs inside the sender's write transaction, so don't wait on a slow
+        # client or on the recipient's own response; the frames are queued
+        # behind it instead.
+        error = protocol.send_frames(
+            user_socket,
+            [protocol.encode_json(msg_msg), protocol.encode_json(users_msg)],
+            block=False
         )
-        protocol.send_json(user_socket, users_msg)
+        if error:
+            logger.warning("Broadcast to %s failed: %s", username, error)
         
     except Exception as e:
-        logger.error(f"Error broadcasting to {username}: {e}")
-        del active_clients[username]
+        logger.error("Error broadcasting to %s: %s", username, e)
+        remove_active_client(username)
+
+def broadcast_presence(joined: tuple = (), left: tuple = ()):
+    """Push a presence diff to every online client instead of the full user list.
+    
+    Users in joined are skipped; they get the full list from broadcast_to_user.
+    """
+    frame = protocol.encode_json(protocol.create_broadcast({
+        "type": "presence",
+        "joined": list(joined),
+        "left": list(left)
+    }))
+    with active_clients_lock:
+        snapshot = tuple(active_clients.items())
+    
+    for username, (client_socket, _) in snapshot:
+        if username in joined:
+            continue
+        error = protocol.send_frames(client_socket, [frame], block=False)
+        if error:
+            logger.warning("Skipped presence update to %s: %s", username, error)
+
+def add_active_client(username: str, client_socket: socket.socket, c: sqlite3.Cursor):
+    """Register a logged-in user, send them full state and announce them to the others."""
+    with active_clients_lock:
+        # Store the actual TCP socket plus timestamp
+        active_clients[username] = (client_socket, time.time())
+    broadcast_to_user(username, c)
+    broadcast_presence(joined=(username,))
+
+def remove_active_client(username: str) -> bool:
+    """Drop a user from active_clients and announce it; returns whether they were online."""
+    with active_clients_lock:
+        was_active = active_clients.pop(username, None) is not None
+    if was_active:
+        broadcast_presence(left=(username,))
+    return was_active
 
 def handle_create_account(data: dict, c: sqlite3.Cursor) -> dict:
     """Handle account creation request."""
-    logger.debug(f"Handling create account request: {data}")
+    logger.debug("Handling create account request: %s", data)
     username = data.get('username')
     password = data.get('password')
     
     if not username or not password:
         return protocol.create_error("Username and password required")
     
-    c.execute("SELECT username FROM accounts WHERE username = ?", (username,))
+    c.execute("SELECT 1 FROM accounts WHERE username = ? LIMIT 1", (username,))
     if c.fetchone():
         return protocol.create_error("Username already exists")
     
     hashed_pwd = hash_password(password)
     try:
         c.execute(
-            "INSERT INTO accounts (username, password, created_at) VALUES (?, ?, ?)",
-            (username, hashed_pwd, datetime.utcnow())
+            "INSERT INTO accounts (username, password) VALUES (?, ?)",
+            (username, hashed_pwd)
         )
         return protocol.create_message(
             MessageType.CREATE_ACCOUNT,
@@ -241,12 +479,12 @@ def handle_create_account(data: dict, c: sqlite3.Cursor) -> dict:
             StatusCode.SUCCESS
         )
     except Exception as e:
-        logger.error(f"Account creation failed: {e}")
+        logger.error("Account creation failed: %s", e)
         return protocol.create_error("Account creation failed")
 
 def handle_login(data: dict, c: sqlite3.Cursor) -> dict:
     """Handle login request."""
-    logger.debug(f"Handling login request: {data}")
+    logger.debug("Handling login request: %s", data)
     username = data.get('username')
     password = data.get('password')
     
@@ -259,13 +497,26 @@ def handle_login(data: dict, c: sqlite3.Cursor) -> dict:
     if not record:
         return protocol.create_error("Username not found")
     
-    if record[0] != hash_password(password):
+    # Bound the scrypt work an attacker can trigger against one account
+    if login_throttled(username):
+        return protocol.create_error("Too many failed login attempts, try again later")
+    
+    verified = verify_password(password, record[0])
+    record_login_result(username, verified)
+    if not verified:
         return protocol.create_error("Incorrect password")
     
+    # Upgrade accounts still on unsalted SHA-256 now that we have the password
+    if not record[0].startswith(SCRYPT_PREFIX):
+        c.execute(
+            "UPDATE accounts SET password = ? WHERE username = ?",
+            (hash_password(password), username)
+        )
+    
     # Update last login
     c.execute(
-        "UPDATE accounts SET last_login = ? WHERE username = ?",
-        (datetime.utcnow(), username)
+        "UPDATE accounts SET last_login = datetime('now') WHERE username = ?",
+        (username,)
     )
     
     # Get unread message count
@@ -286,16 +537,15 @@ def handle_login(data: dict, c: sqlite3.Cursor) -> dict:
 
 def handle_logout(data: dict, c: sqlite3.Cursor) -> dict:
     """Handle user logout request."""
-    logger.debug(f"Handling logout request: {data}")
+    logger.debug("Handling logout request: %s", data)
     username = data.get('username')
 
     if not username:
         return protocol.create_error("Username is required to logout.")
 
     # If the user is in active_clients, remove them
-    if username in active_clients:
-        del active_clients[username]
-        logger.info(f"User '{username}' has been logged out successfully.")
+    if remove_active_client(username):
+        logger.info("User '%s' has been logged out successfully.", username)
         return protocol.create_message(
             MessageType.LOGOUT,
             {},
@@ -306,14 +556,14 @@ def handle_logout(data: dict, c: sqlite3.Cursor) -> dict:
 
 def handle_delete_account(data: dict, c: sqlite3.Cursor) -> dict:
     """Handle account deletion request."""
-    logger.debug(f"Handling delete account request: {data}")
+    logger.debug("Handling delete account request: %s", data)
     username = data.get('username')
     
     if not username:
         return protocol.create_error("Username is required to delete an account.")
     
     # Check if user exists
-    c.execute("SELECT username FROM accounts WHERE username = ?", (username,))
+    c.execute("SELECT 1 FROM accounts WHERE username = ? LIMIT 1", (username,))
     record = c.fetchone()
     if not record:
         return protocol.create_error("User not found.")
@@ -326,19 +576,14 @@ def handle_delete_account(data: dict, c: sqlite3.Cursor) -> dict:
     unread_count = c.fetchone()[0]
 
     try:
-        c.execute(
-            "DELETE FROM messages WHERE sender = ? OR recipient = ?",
-            (username, username)
-        )
+        # trg_accounts_delete_messages removes the user's messages too
         c.execute(
             "DELETE FROM accounts WHERE username = ?",
             (username,)
         )
-        c.connection.commit()
         
         # If the user is currently active, remove them
-        if username in active_clients:
-            del active_clients[username]
+        remove_active_client(username)
         
         return protocol.create_message(
             MessageType.DELETE_ACCOUNT,
@@ -349,46 +594,59 @@ def handle_delete_account(data: dict, c: sqlite3.Cursor) -> dict:
             StatusCode.SUCCESS
         )
     except Exception as e:
-        logger.error(f"Failed to delete account for {username}: {e}")
+        logger.error("Failed to delete account for %s: %s", username, e)
+        c.connection.rollback()
         return protocol.create_error("Failed to delete account.")
 
 def handle_list_accounts(data: dict, c: sqlite3.Cursor) -> dict:
-    """Handle account listing request."""
-    logger.debug(f"Handling list accounts request: {data}")
+    """Handle account listing request.
+    
+    Pages are fetched by keyset: pass the previous response's next_after as
+    after. A bare page number still works for older clients.
+    """
+    logger.debug("Handling list accounts request: %s", data)
     pattern = data.get('pattern', '%')
+    after = data.get('after')
     page = data.get('page', 1)
     per_page = data.get('per_page', 10)
     
-    offset = (page - 1) * per_page
-    
-    c.execute(
-        """SELECT username, created_at, last_login 
-           FROM accounts 
-           WHERE username LIKE ? 
-           ORDER BY username 
-           LIMIT ? OFFSET ?""",
-        (pattern, per_page, offset)
-    )
+    if after is not None or page <= 1:
+        # Seek straight to the page on the username index
+        c.execute(
+            """SELECT username, created_at, last_login 
+               FROM accounts 
+               WHERE username LIKE ? AND username > ?
+               ORDER BY username 
+               LIMIT ?""",
+            (pattern, after or '', per_page)
+        )
+    else:
+        c.execute(
+            """SELECT username, created_at, last_login 
+               FROM accounts 
+               WHERE username LIKE ? 
+               ORDER BY username 
+               LIMIT ? OFFSET ?""",
+            (pattern, per_page, (page - 1) * per_page)
+        )
     
-    accounts = [{
-        "username": row[0],
-        "created_at": row[1],
-        "last_login": row[2]
-    } for row in c.fetchall()]
+    accounts = rows_as_dicts(c)
     
     return protocol.create_message(
         MessageType.LIST_ACCOUNTS,
         {
             "accounts": accounts,
             "page": page,
-            "per_page": per_page
+            "per_page": per_page,
+            # None once the listing is exhausted
+            "next_after": accounts[-1]["username"] if len(accounts) == per_page else None
         },
         StatusCode.SUCCESS
     )
 
 def handle_send_message(data: dict, c: sqlite3.Cursor) -> dict:
     """Handle message sending request."""
-    logger.debug(f"Handling send message request: {data}")
+    logger.debug("Handling send message request: %s", data)
     username = data.get('username')
     recipient = data.get('recipient')
     content = data.get('content')
@@ -396,37 +654,28 @@ def handle_send_message(data: dict, c: sqlite3.Cursor) -> dict:
     if not all([username, recipient, content]):
         return protocol.create_error("Username, recipient, and content are required")
     
-    # Check if recipient exists
-    c.execute("SELECT username FROM accounts WHERE username = ?", (recipient,))
-    if not c.fetchone():
-        return protocol.create_error("Recipient not found")
-    
     try:
-        # Insert message with read status as NULL (unread)
-        c.execute(
-            """INSERT INTO messages (sender, recipient, content, read) 
-               VALUES (?, ?, ?, ?)""",
-            (username, recipient, content, 0)
-        )
-        message_id = c.lastrowid
-        
-        # Verify message was inserted
-        c.execute("SELECT timestamp, read FROM messages WHERE id = ?", (message_id,))
-        result = c.fetchone()
-        if not result:
-            raise Exception("Message insertion failed - no message ID returned")
-        
-        timestamp, read_status = result
-        
-        # Commit the transaction
-        c.connection.commit()
+        # Insert the message as unread. The foreign keys reject an unknown
+        # sender or recipient, and RETURNING hands back the stored row without
+        # a second lookup.
+        try:
+            c.execute(
+                """INSERT INTO messages (sender, recipient, content, read)
+                   VALUES (?, ?, ?, 0)
+                   RETURNING id, timestamp, read""",
+                (username, recipient, content)
+            )
+            message_id, timestamp, read_status = c.fetchone()
+        except sqlite3.IntegrityError:
+            return protocol.create_error("Sender or recipient not found")
         
-        # Broadcast updates to both sender and recipient
+        # Broadcast updates to both sender and recipient. They read through this
+        # connection, so they see the message before handle_client commits it.
         try:
-            broadcast_to_user(username)  # Sender sees their sent message
-            broadcast_to_user(recipient)  # Recipient gets notification
+            broadcast_to_user(username, c)  # Sender sees their sent message
+            broadcast_to_user(recipient, c)  # Recipient gets notification
         except Exception as e:
-            logger.error(f"Failed to broadcast message: {e}")
+            logger.error("Failed to broadcast message: %s", e)
             # Don't return error since message was saved successfully
         
         return protocol.create_message(
@@ -439,12 +688,12 @@ def handle_send_message(data: dict, c: sqlite3.Cursor) -> dict:
             StatusCode.SUCCESS
         )
     except Exception as e:
-        logger.error(f"Failed to send message. Error: {str(e)}")
+        logger.error("Failed to send message. Error: %s", e)
         return protocol.create_error(f"Failed to send message: {str(e)}")
 
 def handle_get_messages(data: dict, c: sqlite3.Cursor) -> dict:
     """Handle message retrieval request."""
-    logger.debug(f"Handling get messages request: {data}")
+    logger.debug("Handling get messages request: %s", data)
     username = data.get('username')
     count = data.get('count', 10)  # Default to 10 messages
     
@@ -458,7 +707,7 @@ def handle_get_messages(data: dict, c: sqlite3.Cursor) -> dict:
                       CASE
                           WHEN read IS 0 THEN 0
                           ELSE read
-                      END as read_status
+                      END AS read
                FROM messages 
                WHERE recipient = ? 
                ORDER BY timestamp DESC 
@@ -466,15 +715,7 @@ def handle_get_messages(data: dict, c: sqlite3.Cursor) -> dict:
             (username, count)
         )
         
-        messages = []
-        for row in c.fetchall():
-            messages.append({
-                'id': row[0],
-                'sender': row[1],
-                'content': row[2],
-                'timestamp': row[3],
-                'read': row[4]  # This will be 0 for NULL (unread) or 1 for read
-            })
+        messages = rows_as_dicts(c)
         
         return protocol.create_message(
             MessageType.GET_MESSAGES,
@@ -482,12 +723,12 @@ def handle_get_messages(data: dict, c: sqlite3.Cursor) -> dict:
             StatusCode.SUCCESS
         )
     except Exception as e:
-        logger.error(f"Failed to get messages. Error: {str(e)}")
+        logger.error("Failed to get messages. Error: %s", e)
         return protocol.create_error(f"Failed to get messages: {str(e)}")
 
 def handle_delete_messages(data: dict, c: sqlite3.Cursor) -> dict:
     """Handle message deletion request."""
-    logger.debug(f"Handling delete messages request: {data}")
+    logger.debug("Handling delete messages request: %s", data)
     username = data.get('username')
     message_ids = data.get('message_ids', [])
     
@@ -495,18 +736,19 @@ def handle_delete_messages(data: dict, c: sqlite3.Cursor) -> dict:
         return protocol.create_error("Username and message IDs required")
     
     try:
-        # Only delete messages where the user is either sender or recipient
-        placeholders = ','.join('?' * len(message_ids))
-        c.execute(
-            f"""DELETE FROM messages 
-                WHERE id IN ({placeholders})
-                AND (sender = ? OR recipient = ?)""",
-            (*message_ids, username, username)
+        # Only delete messages where the user is either sender or recipient.
+        # One fixed-shape statement stays in the statement cache whatever the
+        # batch size; rowcount sums over all rows.
+        c.executemany(
+            """DELETE FROM messages 
+               WHERE id = ?
+               AND (sender = ? OR recipient = ?)""",
+            [(message_id, username, username) for message_id in message_ids]
         )
         
         deleted_count = c.rowcount
         if deleted_count > 0:
-            logger.info(f"Permanently deleted {deleted_count} messages")
+            logger.info("Permanently deleted %s messages", deleted_count)
         
         return protocol.create_message(
             MessageType.DELETE_MESSAGES,
@@ -514,12 +756,12 @@ def handle_delete_messages(data: dict, c: sqlite3.Cursor) -> dict:
             StatusCode.SUCCESS
         )
     except Exception as e:
-        logger.error(f"Failed to delete messages: {e}")
+        logger.error("Failed to delete messages: %s", e)
         return protocol.create_error("Failed to delete messages")
 
 def handle_mark_as_read(data: dict, c: sqlite3.Cursor) -> dict:
     """Handle marking messages as read."""
-    logger.debug(f"Handling mark as read request: {data}")
+    logger.debug("Handling mark as read request: %s", data)
     username = data.get('username')
     message_ids = data.get('message_ids', [])
     
@@ -528,31 +770,56 @@ def handle_mark_as_read(data: dict, c: sqlite3.Cursor) -> dict:
     
     try:
         # Only mark messages as read if user is the recipient
-        placeholders = ','.join('?' * len(message_ids))
-        c.execute(
-            f"""UPDATE messages 
-                SET read = 1 
-                WHERE id IN ({placeholders})
-                AND recipient = ?""",
-            (*message_ids, username)
+        c.executemany(
+            """UPDATE messages 
+               SET read = 1 
+               WHERE id = ?
+               AND recipient = ?""",
+            [(message_id, username) for message_id in message_ids]
         )
         
-        # Commit the changes
-        c.connection.commit()
-        
         return protocol.create_message(
             MessageType.MARK_AS_READ,
             {"marked_count": c.rowcount},
             StatusCode.SUCCESS
         )
     except Exception as e:
-        logger.error(f"Failed to mark messages as read: {e}")
+        logger.error("Failed to mark messages as read: %s", e)
         return protocol.create_error("Failed to mark messages as read")
 
+# Route message types to their handlers, keyed by the raw wire value so
+# dispatch is one dict lookup with no enum construction
+HANDLER_MAP = {
+    MessageType.CREATE_ACCOUNT.value: handle_create_account,
+    MessageType.LOGIN.value: handle_login,
+    MessageType.LIST_ACCOUNTS.value: handle_list_accounts,
+    MessageType.SEND_MESSAGE.value: handle_send_message,
+    MessageType.GET_MESSAGES.value: handle_get_messages,
+    MessageType.DELETE_MESSAGES.value: handle_delete_messages,
+    MessageType.DELETE_ACCOUNT.value: handle_delete_account,
+    MessageType.LOGOUT.value: handle_logout,
+    MessageType.MARK_AS_READ.value: handle_mark_as_read
+}
+
+# Requests whose handlers write; these run inside BEGIN IMMEDIATE so the write
+# lock is taken up front instead of upgrading a read lock mid-transaction.
+# Account creation and login are left out: they spend most of their time in
+# scrypt and make a single write, which autocommits on its own.
+WRITE_MESSAGE_TYPES = frozenset({
+    MessageType.SEND_MESSAGE.value,
+    MessageType.DELETE_MESSAGES.value,
+    MessageType.DELETE_ACCOUNT.value,
+    MessageType.MARK_AS_READ.value
+})
+
 def handle_client(client_socket: socket.socket, addr: tuple):
     """Handle client connection and route messages to appropriate handlers."""
-    logger.info(f"New client connected: {addr}")
+    logger.info("New client connected: %s", addr)
     client_username = None
+    # Pool workers keep their connection across clients, so SQLite's statement
+    # cache stays warm and no request opens the database
+    conn = get_thread_connection()
+    c = conn.cursor()
     try:
         while True:
             message = protocol.recv_json(client_socket)
@@ -560,96 +827,124 @@ def handle_client(client_socket: socket.socket, addr: tuple):
                 break
             # Error occurred
             if isinstance(message, str):
-                logger.error(f"Error receiving message: {message}")
+                logger.error("Error receiving message: %s", message)
                 continue
-                
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
             
             try:
-                msg_type = MessageType(message['type'])
+                msg_type = message['type']
                 data = message['data']
                 
-                # Route message to appropriate handler
-                handler_map = {
-                    MessageType.CREATE_ACCOUNT: handle_create_account,
-                    MessageType.LOGIN: handle_login,
-                    MessageType.LIST_ACCOUNTS: handle_list_accounts,
-                    MessageType.SEND_MESSAGE: handle_send_message,
-                    MessageType.GET_MESSAGES: handle_get_messages,
-                    MessageType.DELETE_MESSAGES: handle_delete_messages,
-                    MessageType.DELETE_ACCOUNT: handle_delete_account,
-                    MessageType.LOGOUT: handle_logout,
-                    MessageType.MARK_AS_READ: handle_mark_as_read
-                }
-                
-                handler = handler_map.get(msg_type)
-                if handler:
+                handler = HANDLER_MAP.get(msg_type)
+                if handler and msg_type in WRITE_MESSAGE_TYPES:
+                    # SQLite allows one writer at a time; queueing on a lock hands
+                    # it over directly instead of polling SQLite's busy handler
+                    with db_write_lock:
+                        c.execute("BEGIN IMMEDIATE")
+                        try:
+                            response = handler(data, c)
+                            # Single commit per request; handlers don't commit themselves
+                            conn.commit()
+                        except Exception:
+                            conn.rollback()
+                            raise
+                elif handler:
                     response = handler(data, c)
-                    conn.commit()
                 else:
                     response = protocol.create_error(f"Unsupported message type: {msg_type}")
                 
                 protocol.send_json(client_socket, response)
                 
                 # Track username after successful login
-                if message['type'] == MessageType.LOGIN.value and message['status'] == StatusCode.SUCCESS.value:
+                if msg_type == MessageType.LOGIN.value and response['status'] == StatusCode.SUCCESS.value:
                     username = data['username']
+                    if client_username and client_username != username:
+                        remove_active_client(client_username)
                     client_username = username
-                    
-                    # Store the actual TCP socket plus timestamp
-                    active_clients[username] = (client_socket, time.time())
+                    add_active_client(username, client_socket, c)
                     
             except Exception as e:
-                logger.error(f"Error handling message: {e}")
+                logger.error("Error handling message: %s", e)
                 protocol.send_json(client_socket, protocol.create_error(str(e)))
                 conn.rollback()
-            finally:
-                conn.close()
                 
     except Exception as e:
-        logger.error(f"Client connection error: {e}")
+        logger.error("Client connection error: %s", e)
     finally:
-        if client_username and client_username in active_clients:
-            del active_clients[client_username]
+        if client_username:
+            remove_active_client(client_username)
+        # Leave the worker's connection clean for its next client
+        conn.rollback()
+        with active_clients_lock:
+            client_sockets.discard(client_socket)
         client_socket.close()
-        logger.info(f"Client disconnected: {addr}")
+        logger.info("Client disconnected: %s", addr)
 
 def start_server():
     """Start the chat server."""
-    global server_socket, db_conn, cursor
+    global server_socket
+    
+    # Per-message debug logging writes to stderr synchronously on every request,
+    # so it is only enabled when explicitly configured. Only the server's own
+    # loggers are touched; importing this module leaves logging alone.
+    for module_logger in (logger, protocol.logger):
+        module_logger.setLevel(config["log_level"])
     
     # Initialize database
-    db_conn = sqlite3.connect(DB_PATH)
-    cursor = db_conn.cursor()
     init_db()
     migrate_database()
     
     # Create server socket
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        # Allows a replacement server to bind while the old one drains
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     server_socket.bind((HOST, PORT))
-    server_socket.listen()
+    # Use the kernel's largest accept queue so connection bursts aren't refused
+    server_socket.listen(socket.SOMAXCONN)
     
-    logger.info(f"Server started on {HOST}:{PORT}")
+    logger.info("Server started on %s:%s", HOST, PORT)
     
     # Start broadcast thread
+    shutdown_event.clear()
     broadcast_thread = threading.Thread(target=broadcast_updates, daemon=True)
     broadcast_thread.start()
     
+    # Applies to every thread created from here on, including pool workers
+    threading.stack_size(CLIENT_THREAD_STACK_SIZE)
+    pool = ThreadPoolExecutor(max_workers=MAX_CLIENT_WORKERS, thread_name_prefix="chat")
+    
     try:
         while True:
             conn, addr = server_socket.accept()
-            logger.info(f"New connection from {addr}")
-            client_thread = threading.Thread(target=handle_client, args=(conn, addr))
-            client_thread.start()
+            logger.info("New connection from %s", addr)
+            with active_clients_lock:
+                full = len(client_sockets) >= MAX_CLIENT_WORKERS
+                if not full:
+                    client_sockets.add(conn)
+            if full:
+                logger.warning("Refusing %s: %s clients connected", addr, MAX_CLIENT_WORKERS)
+                protocol.send_frames(conn, [protocol.encode_json(
+                    protocol.create_error("Server is full, try again later")
+                )], block=False)
+                conn.close()
+                continue
+            protocol.configure_socket(conn)
+            pool.submit(handle_client, conn, addr)
     except KeyboardInterrupt:
         logger.info("Server shutting down...")
     finally:
+        shutdown_event.set()
         if server_socket:
             server_socket.close()
-        if db_conn:
-            db_conn.close()
+        # Wake workers blocked on recv so the pool can drain
+        with active_clients_lock:
+            for sock in client_sockets:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        pool.shutdown(wait=True, cancel_futures=True)
 
 if __name__ == '__main__':
     start_server()
@@ -30,10 +30,10 @@ class TestChatClient(unittest.TestCase):
         self.socket_patcher = patch('socket.socket')
         self.mock_socket = self.socket_patcher.start()
         
-        # Mock socket connection and file-like object
+        # Mock socket connection and an immediately closed stream
         self.mock_socket.return_value.connect = MagicMock()
         self.mock_socket.return_value.send = MagicMock()
-        self.mock_socket.return_value.makefile.return_value.readline.return_value = ""
+        self.mock_socket.return_value.recv_into.return_value = 0
         
         # Create client instance
         with patch('tkinter.Entry') as mock_entry:
@@ -82,7 +82,7 @@ class TestChatClient(unittest.TestCase):
         # Mock socket instance
         mock_socket = MagicMock()
         mock_socket_class.return_value = mock_socket
-        mock_socket.makefile.return_value.readline.return_value = ""
+        mock_socket.recv_into.return_value = 0
         
         # Mock entry values
         self.client.username_entry.get.return_value = username
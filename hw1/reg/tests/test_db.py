@@ -2,24 +2,19 @@ import unittest
 import sys
 import os
 import sqlite3
+import shutil
 import tempfile
 from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 class TestDatabase(unittest.TestCase):
-    def setUp(self):
-        """Create a temporary database for testing"""
-        self.temp_db = tempfile.NamedTemporaryFile(delete=False)
-        self.db_path = self.temp_db.name
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
-        
-        # Enable foreign key constraints
-        self.cursor.execute("PRAGMA foreign_keys = ON")
-        
-        # Create necessary tables
-        self.cursor.execute('''
+    @classmethod
+    def setUpClass(cls):
+        """Build the schema once; each test starts from a copy of it"""
+        cls.template_db = tempfile.NamedTemporaryFile(delete=False).name
+        conn = sqlite3.connect(cls.template_db)
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS accounts (
                 username TEXT PRIMARY KEY,
                 password TEXT NOT NULL,
@@ -28,7 +23,7 @@ class TestDatabase(unittest.TestCase):
             )
         ''')
         
-        self.cursor.execute('''
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS messages (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 sender TEXT NOT NULL,
@@ -41,7 +36,29 @@ class TestDatabase(unittest.TestCase):
                 FOREIGN KEY (recipient) REFERENCES accounts(username)
             )
         ''')
-        self.conn.commit()
+        conn.commit()
+        conn.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Delete the template database"""
+        os.unlink(cls.template_db)
+
+    def setUp(self):
+        """Create a temporary database for testing"""
+        self.temp_db = tempfile.NamedTemporaryFile(delete=False)
+        self.db_path = self.temp_db.name
+        shutil.copyfile(self.template_db, self.db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.cursor = self.conn.cursor()
+        
+        # Enable foreign key constraints
+        self.cursor.execute("PRAGMA foreign_keys = ON")
+        
+        # Throwaway database: skip fsyncs and keep the journal in memory
+        self.cursor.execute("PRAGMA synchronous = OFF")
+        self.cursor.execute("PRAGMA journal_mode = MEMORY")
+        self.cursor.execute("PRAGMA temp_store = MEMORY")
 
     def tearDown(self):
         """Clean up the temporary database"""
@@ -70,8 +87,10 @@ class TestDatabase(unittest.TestCase):
     def test_message_creation(self):
         """Test creating a new message between users"""
         # Create sender and recipient accounts
-        self.cursor.execute("INSERT INTO accounts (username, password) VALUES (?, ?)", ("sender", "pass1"))
-        self.cursor.execute("INSERT INTO accounts (username, password) VALUES (?, ?)", ("recipient", "pass2"))
+        self.cursor.executemany(
+            "INSERT INTO accounts (username, password) VALUES (?, ?)",
+            [("sender", "pass1"), ("recipient", "pass2")]
+        )
         self.conn.commit()
         
         # Send message
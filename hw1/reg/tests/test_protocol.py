@@ -2,10 +2,16 @@ import unittest
 import sys
 import os
 import json
+import gc
+import socket
+import threading
+import time
 from datetime import datetime
+from unittest.mock import patch
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from protocol import MessageType, StatusCode, create_message, validate_message
+import protocol
+from protocol import MessageType, StatusCode, create_message, create_broadcast, validate_message, encode_json, send_frames, recv_json
 
 class TestProtocol(unittest.TestCase):
     def test_create_message_basic(self):
@@ -54,6 +60,16 @@ class TestProtocol(unittest.TestCase):
         }
         self.assertFalse(validate_message(message))
 
+    def test_validate_message_unhashable_type(self):
+        """Test validation fails, rather than raising, when the type is a JSON array"""
+        message = {
+            "type": [MessageType.LOGIN.value],
+            "data": {"username": "testuser"},
+            "timestamp": datetime.utcnow().isoformat(),
+            "status": StatusCode.PENDING.value
+        }
+        self.assertFalse(validate_message(message))
+
     def test_validate_message_invalid_status(self):
         """Test validation fails with invalid status"""
         message = {
@@ -64,5 +80,161 @@ class TestProtocol(unittest.TestCase):
         }
         self.assertFalse(validate_message(message))
 
+    def test_create_broadcast(self):
+        """Test the broadcast fast path builds a valid BROADCAST message"""
+        data = {"type": "users", "users": ["a", "b"]}
+        message = create_broadcast(data)
+        
+        self.assertTrue(validate_message(message))
+        self.assertEqual(message["type"], MessageType.BROADCAST.value)
+        self.assertEqual(message["status"], StatusCode.SUCCESS.value)
+        self.assertEqual(message["data"], data)
+
+    def test_create_broadcast_shared_timestamp(self):
+        """Test broadcasts built in one pass can share a timestamp"""
+        timestamp = datetime.utcnow().isoformat()
+        first = create_broadcast({"type": "users", "users": []}, timestamp)
+        second = create_broadcast({"type": "messages", "messages": []}, timestamp)
+        
+        self.assertEqual(first["timestamp"], timestamp)
+        self.assertEqual(second["timestamp"], timestamp)
+
+    def test_encode_json_compact(self):
+        """Test that encoded frames are compact, length-prefixed and round-trip"""
+        message = create_message(MessageType.SEND_MESSAGE, {"recipient": "bob", "content": "héllo"})
+        frame = encode_json(message)
+        header, payload = frame[:4], frame[4:]
+        
+        self.assertEqual(protocol.FRAME_HEADER.unpack(header)[0], len(payload))
+        self.assertNotIn(b'": ', payload)
+        self.assertIn("héllo".encode('utf-8'), payload)
+        self.assertEqual(json.loads(payload), message)
+
+    def test_encode_json_without_orjson(self):
+        """Test the stdlib fallback produces the same frame as orjson"""
+        message = create_message(MessageType.SEND_MESSAGE, {"recipient": "bob", "content": "héllo"})
+        frame = encode_json(message)
+        
+        with patch.object(protocol, "orjson", None):
+            self.assertEqual(encode_json(message), frame)
+            self.assertEqual(protocol.loads(frame[4:]), message)
+            self.assertEqual(protocol.loads(memoryview(frame)[4:]), message)
+
+    def test_send_frames(self):
+        """Test that encoded frames arrive intact and in order from one gathered write"""
+        first = create_message(MessageType.BROADCAST, {"type": "users", "users": ["a", "b"]})
+        second = create_message(MessageType.BROADCAST, {"type": "messages", "messages": []})
+        
+        sender, receiver = socket.socketpair()
+        try:
+            self.assertIsNone(send_frames(sender, [encode_json(first), encode_json(second)], block=False))
+            sender.close()
+            
+            self.assertEqual(recv_json(receiver), first)
+            self.assertEqual(recv_json(receiver), second)
+            self.assertIsNone(recv_json(receiver))
+        finally:
+            receiver.close()
+
+    def test_send_frames_partial_write_is_finished_by_next_send(self):
+        """Test a non-blocking send that fills the buffer keeps its tail instead of blocking"""
+        big = create_message(MessageType.BROADCAST, {"type": "messages", "messages": ["x" * 1024] * 1024})
+        small = create_message(MessageType.LOGOUT, {"username": "a"})
+        
+        sender, receiver = socket.socketpair()
+        try:
+            sender.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+            self.assertIsNone(send_frames(sender, [encode_json(big)], block=False))
+            self.assertTrue(protocol._send_states[sender].pending)
+            
+            # A blocking send flushes the tail first, so both frames arrive whole
+            writer = threading.Thread(target=send_frames, args=(sender, [encode_json(small)]))
+            writer.start()
+            self.assertEqual(recv_json(receiver), big)
+            self.assertEqual(recv_json(receiver), small)
+            writer.join()
+        finally:
+            sender.close()
+            receiver.close()
+
+    def test_send_frames_push_racing_a_response_is_queued(self):
+        """Test a non-blocking push to a socket another thread is writing is sent after it, not dropped"""
+        response = create_message(MessageType.BROADCAST, {"type": "messages", "messages": ["x" * 1024] * 1024})
+        push = create_message(MessageType.BROADCAST, {"type": "presence", "joined": ["b"], "left": []})
+        
+        sender, receiver = socket.socketpair()
+        try:
+            sender.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+            # The response fills the buffer, so its writer blocks until the peer reads
+            writer = threading.Thread(target=send_frames, args=(sender, [encode_json(response)]))
+            writer.start()
+            state = protocol._get_send_state(sender)
+            while not state.busy:
+                time.sleep(0.001)
+            
+            self.assertIsNone(send_frames(sender, [encode_json(push)], block=False))
+            self.assertEqual(recv_json(receiver), response)
+            self.assertEqual(recv_json(receiver), push)
+            writer.join()
+            self.assertFalse(state.busy)
+        finally:
+            sender.close()
+            receiver.close()
+
+    def test_recv_json_keeps_buffered_frames(self):
+        """Test frames that arrive in one segment are all returned, in order"""
+        first = create_message(MessageType.LOGIN, {"username": "a"})
+        second = create_message(MessageType.LOGOUT, {"username": "a"})
+        
+        sender, receiver = socket.socketpair()
+        try:
+            sender.sendall(encode_json(first) + encode_json(second))
+            sender.close()
+            
+            self.assertEqual(recv_json(receiver), first)
+            self.assertEqual(recv_json(receiver), second)
+            self.assertIsNone(recv_json(receiver))
+        finally:
+            receiver.close()
+
+    def test_recv_json_legacy_newline_frames(self):
+        """Test newline-delimited frames from older peers are still accepted"""
+        first = create_message(MessageType.LOGIN, {"username": "a"})
+        second = create_message(MessageType.LOGOUT, {"username": "a"})
+        
+        sender, receiver = socket.socketpair()
+        try:
+            sender.sendall((json.dumps(first) + "\n").encode('utf-8') + encode_json(second))
+            sender.close()
+            
+            self.assertEqual(recv_json(receiver), first)
+            self.assertEqual(recv_json(receiver), second)
+        finally:
+            receiver.close()
+
+    def test_recv_json_framer_released_with_socket(self):
+        """Test a socket's receive buffer is dropped once the socket is gone"""
+        sender, receiver = socket.socketpair()
+        sender.sendall(encode_json(create_message(MessageType.LOGIN, {"username": "a"})))
+        recv_json(receiver)
+        self.assertIn(receiver, protocol._framers)
+        
+        sender.close()
+        receiver.close()
+        count = len(protocol._framers)
+        del receiver
+        gc.collect()
+        self.assertEqual(len(protocol._framers), count - 1)
+
+    def test_recv_json_oversized_frame(self):
+        """Test an oversized length prefix drops the connection instead of allocating"""
+        sender, receiver = socket.socketpair()
+        try:
+            sender.sendall(protocol.FRAME_HEADER.pack(protocol.MAX_FRAME_SIZE + 1))
+            self.assertIsNone(recv_json(receiver))
+        finally:
+            sender.close()
+            receiver.close()
+
 if __name__ == '__main__':
     unittest.main()
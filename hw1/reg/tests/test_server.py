@@ -5,27 +5,22 @@ import socket
 import threading
 import json
 import sqlite3
+import hashlib
 from unittest.mock import MagicMock, patch
+import shutil
 import tempfile
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import server
-from protocol import MessageType, StatusCode, create_message
+from protocol import MessageType, StatusCode, create_message, recv_json
 
 class TestServer(unittest.TestCase):
-    def setUp(self):
-        """Set up test environment before each test"""
-        # Create a temporary database for testing
-        self.temp_db = tempfile.NamedTemporaryFile(delete=False)
-        self.db_path = self.temp_db.name
-        server.DB_PATH = self.db_path  # Set the server's DB path
-        
-        # Initialize the database
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
-        
-        # Create necessary tables
-        self.cursor.execute('''
+    @classmethod
+    def setUpClass(cls):
+        """Build the schema once; each test starts from a copy of it"""
+        cls.template_db = tempfile.NamedTemporaryFile(delete=False).name
+        conn = sqlite3.connect(cls.template_db)
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS accounts (
                 username TEXT PRIMARY KEY,
                 password TEXT NOT NULL,
@@ -34,7 +29,7 @@ class TestServer(unittest.TestCase):
             )
         ''')
         
-        self.cursor.execute('''
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS messages (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 sender TEXT NOT NULL,
@@ -47,13 +42,33 @@ class TestServer(unittest.TestCase):
                 FOREIGN KEY (recipient) REFERENCES accounts(username)
             )
         ''')
+        conn.commit()
+        conn.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Delete the template database"""
+        os.unlink(cls.template_db)
+
+    def setUp(self):
+        """Set up test environment before each test"""
+        # Create a temporary database for testing
+        self.temp_db = tempfile.NamedTemporaryFile(delete=False)
+        self.db_path = self.temp_db.name
+        shutil.copyfile(self.template_db, self.db_path)
+        server.DB_PATH = self.db_path  # Set the server's DB path
         
-        self.conn.commit()
+        # Initialize the database
+        self.conn = sqlite3.connect(self.db_path)
+        # Match the server's connections, which enforce foreign keys
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.cursor = self.conn.cursor()
 
     def tearDown(self):
         """Clean up after each test"""
         self.conn.close()
         os.unlink(self.db_path)  # Delete the temporary database
+        server._login_failures.clear()
 
     def test_create_account(self):
         """Test account creation"""
@@ -130,6 +145,93 @@ class TestServer(unittest.TestCase):
         # Verify error response
         self.assertEqual(result["status"], StatusCode.ERROR.value)
 
+    def test_login_throttled_after_failures(self):
+        """Test repeated failed logins lock the account out for the window"""
+        server.handle_create_account({"username": "testuser", "password": "testpass"}, self.cursor)
+        self.conn.commit()
+        
+        for _ in range(server.LOGIN_MAX_FAILURES):
+            result = server.handle_login({"username": "testuser", "password": "wrong"}, self.cursor)
+            self.assertEqual(result["data"]["message"], "Incorrect password")
+        
+        with patch.object(server, "verify_password") as verify:
+            result = server.handle_login({"username": "testuser", "password": "testpass"}, self.cursor)
+            verify.assert_not_called()
+        self.assertEqual(result["status"], StatusCode.ERROR.value)
+        
+        # Once the window has passed, the correct password works again
+        with patch.object(server.time, "monotonic", return_value=server.time.monotonic() + server.LOGIN_FAILURE_WINDOW + 1):
+            result = server.handle_login({"username": "testuser", "password": "testpass"}, self.cursor)
+        self.assertEqual(result["status"], StatusCode.SUCCESS.value)
+
+    def test_password_hashing(self):
+        """Test scrypt hashes are salted and verify, and legacy SHA-256 hashes still verify"""
+        first = server.hash_password("secret")
+        second = server.hash_password("secret")
+        
+        self.assertNotEqual(first, second)
+        self.assertTrue(server.verify_password("secret", first))
+        self.assertFalse(server.verify_password("wrong", first))
+        
+        # Pre-encoded passwords hash and verify the same as str
+        self.assertTrue(server.verify_password(b"secret", first))
+        self.assertTrue(server.verify_password("secret", server.hash_password(b"secret")))
+        
+        legacy = hashlib.sha256("secret".encode('utf-8')).hexdigest()
+        self.assertTrue(server.verify_password("secret", legacy))
+        self.assertFalse(server.verify_password("wrong", legacy))
+
+    def test_verify_password_cache(self):
+        """Test repeat verifications of a correct password skip scrypt, wrong ones don't"""
+        stored = server.hash_password("secret")
+        self.assertTrue(server.verify_password("secret", stored))
+        
+        with patch.object(server, "_scrypt", wraps=server._scrypt) as scrypt:
+            self.assertTrue(server.verify_password("secret", stored))
+            scrypt.assert_not_called()
+            self.assertFalse(server.verify_password("wrong", stored))
+            scrypt.assert_called_once()
+
+    def test_handle_list_accounts_pagination(self):
+        """Test keyset pages and legacy page numbers return the same accounts"""
+        for username in ("alice", "bob", "carol", "dave", "erin"):
+            self.cursor.execute(
+                "INSERT INTO accounts (username, password) VALUES (?, ?)",
+                (username, "hash")
+            )
+        self.conn.commit()
+        
+        first = server.handle_list_accounts({"per_page": 2}, self.cursor)["data"]
+        second = server.handle_list_accounts({"per_page": 2, "after": first["next_after"]}, self.cursor)["data"]
+        third = server.handle_list_accounts({"per_page": 2, "after": second["next_after"]}, self.cursor)["data"]
+        
+        names = lambda page: [a["username"] for a in page["accounts"]]
+        self.assertEqual(names(first), ["alice", "bob"])
+        self.assertEqual(names(second), ["carol", "dave"])
+        self.assertEqual(names(third), ["erin"])
+        self.assertIsNone(third["next_after"])
+        
+        legacy = server.handle_list_accounts({"per_page": 2, "page": 2}, self.cursor)["data"]
+        self.assertEqual(names(legacy), names(second))
+
+    def test_login_upgrades_legacy_hash(self):
+        """Test a successful login rehashes a legacy SHA-256 password with scrypt"""
+        legacy = hashlib.sha256("testpass".encode('utf-8')).hexdigest()
+        self.cursor.execute(
+            "INSERT INTO accounts (username, password) VALUES (?, ?)",
+            ("testuser", legacy)
+        )
+        self.conn.commit()
+        
+        result = server.handle_login({"username": "testuser", "password": "testpass"}, self.cursor)
+        self.conn.commit()
+        
+        self.assertEqual(result["status"], StatusCode.SUCCESS.value)
+        self.cursor.execute("SELECT password FROM accounts WHERE username = ?", ("testuser",))
+        stored = self.cursor.fetchone()[0]
+        self.assertTrue(stored.startswith(server.SCRYPT_PREFIX))
+        self.assertTrue(server.verify_password("testpass", stored))
+
     def test_handle_send_message(self):
         """Test message sending"""
         # Create sender and recipient accounts
@@ -168,5 +270,111 @@ class TestServer(unittest.TestCase):
         self.assertEqual(msg[1], message_data["recipient"])
         self.assertEqual(msg[2], message_data["content"])
 
+    def test_handle_send_message_unknown_recipient(self):
+        """Test sending to a recipient that does not exist stores nothing"""
+        server.handle_create_account({"username": "sender", "password": "pass"}, self.cursor)
+        self.conn.commit()
+        
+        result = server.handle_send_message({
+            "username": "sender",
+            "recipient": "nobody",
+            "content": "Hello?"
+        }, self.cursor)
+        self.conn.commit()
+        
+        self.assertEqual(result["status"], StatusCode.ERROR.value)
+        self.cursor.execute("SELECT COUNT(*) FROM messages")
+        self.assertEqual(self.cursor.fetchone()[0], 0)
+
+    def test_fetch_recent_messages(self):
+        """Test recent messages are grouped by recipient and capped per recipient"""
+        for username in ("alice", "bob", "carol"):
+            server.handle_create_account({"username": username, "password": "pass"}, self.cursor)
+        self.conn.commit()
+        
+        # Give alice more messages than the per-recipient limit
+        for i in range(server.RECENT_MESSAGES_LIMIT + 5):
+            self.cursor.execute(
+                "INSERT INTO messages (sender, recipient, content, timestamp) VALUES (?, ?, ?, ?)",
+                ("bob", "alice", f"msg {i}", f"2025-01-01 00:{i // 60:02d}:{i % 60:02d}")
+            )
+        self.cursor.execute(
+            "INSERT INTO messages (sender, recipient, content) VALUES (?, ?, ?)",
+            ("alice", "bob", "hi bob")
+        )
+        self.conn.commit()
+        
+        recent = server.fetch_recent_messages(self.cursor, ["alice", "bob", "carol"])
+        
+        self.assertEqual(len(recent["alice"]), server.RECENT_MESSAGES_LIMIT)
+        self.assertEqual(recent["alice"][0]["content"], f"msg {server.RECENT_MESSAGES_LIMIT + 4}")
+        self.assertEqual([m["content"] for m in recent["bob"]], ["hi bob"])
+        self.assertEqual(recent["carol"], [])
+
+    def test_handle_delete_messages(self):
+        """Test only messages the user sent or received are deleted, and counted"""
+        for username in ("alice", "bob", "carol"):
+            server.handle_create_account({"username": username, "password": "pass"}, self.cursor)
+        ids = []
+        for sender, recipient in (("alice", "bob"), ("bob", "alice"), ("bob", "carol")):
+            result = server.handle_send_message({
+                "username": sender,
+                "recipient": recipient,
+                "content": "hi"
+            }, self.cursor)
+            ids.append(result["data"]["id"])
+        self.conn.commit()
+        
+        result = server.handle_delete_messages({"username": "alice", "message_ids": ids}, self.cursor)
+        self.conn.commit()
+        
+        self.assertEqual(result["data"]["deleted_count"], 2)
+        self.cursor.execute("SELECT id FROM messages")
+        self.assertEqual(self.cursor.fetchall(), [(ids[2],)])
+
+    def test_handle_delete_account_removes_messages(self):
+        """Test deleting an account also removes messages it sent or received"""
+        server.init_db()
+        for username in ("alice", "bob", "carol"):
+            server.handle_create_account({"username": username, "password": "pass"}, self.cursor)
+        for sender, recipient in (("alice", "bob"), ("bob", "alice"), ("bob", "carol")):
+            server.handle_send_message({
+                "username": sender,
+                "recipient": recipient,
+                "content": "hi"
+            }, self.cursor)
+        self.conn.commit()
+        
+        result = server.handle_delete_account({"username": "alice"}, self.cursor)
+        self.conn.commit()
+        
+        self.assertEqual(result["status"], StatusCode.SUCCESS.value)
+        self.cursor.execute("SELECT sender, recipient FROM messages")
+        self.assertEqual(self.cursor.fetchall(), [("bob", "carol")])
+
+    def test_presence_updates(self):
+        """Test logins and logouts push presence diffs to the other online users"""
+        alice_server, alice_client = socket.socketpair()
+        bob_server, bob_client = socket.socketpair()
+        try:
+            server.active_clients["alice"] = (alice_server, 0)
+            server.add_active_client("bob", bob_server, self.cursor)
+            
+            # bob gets full state, alice only the diff
+            bob_frames = [recv_json(bob_client), recv_json(bob_client)]
+            self.assertEqual([f["data"]["type"] for f in bob_frames], ["messages", "users"])
+            self.assertEqual(sorted(bob_frames[1]["data"]["users"]), ["alice", "bob"])
+            joined = recv_json(alice_client)
+            self.assertEqual(joined["data"], {"type": "presence", "joined": ["bob"], "left": []})
+            
+            self.assertTrue(server.remove_active_client("bob"))
+            left = recv_json(alice_client)
+            self.assertEqual(left["data"], {"type": "presence", "joined": [], "left": ["bob"]})
+            self.assertFalse(server.remove_active_client("bob"))
+        finally:
+            server.active_clients.clear()
+            for sock in (alice_server, alice_client, bob_server, bob_client):
+                sock.close()
+
 if __name__ == '__main__':
     unittest.main()
@@ -30,6 +30,19 @@ import analyze_logs
 import run_experiment1
 import run_experiment2
 
+def wait_for_listener(port, timeout=1.0):
+    """Wait until a VM accepts connections on port, rather than sleeping a fixed time."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            # The VM drops a connection that closes without identifying itself
+            socket.create_connection(('localhost', port), timeout=0.05).close()
+            return
+        except OSError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.01)
+
 class TestVirtualMachine(unittest.TestCase):
     """Test the VirtualMachine class functionality."""
     
@@ -118,7 +131,7 @@ class TestVirtualMachine(unittest.TestCase):
         
         # Initialize network
         self.vm1.initialize_network()
-        time.sleep(1)  # Allow time for server socket to start
+        wait_for_listener(self.vm1_port)
         self.vm2.initialize_network()
         time.sleep(2)  # Allow time for connections to establish
         
@@ -136,7 +149,7 @@ class TestVirtualMachine(unittest.TestCase):
         
         # Initialize network and start VMs
         self.vm1.initialize_network()
-        time.sleep(0.5)
+        wait_for_listener(self.vm1_port)
         self.vm2.initialize_network()
         time.sleep(1.5)
         